@@ -0,0 +1,82 @@
+"""
+Throughput of concurrent favorite writes with and without group commit
+(src/groupcommit.py).
+
+    $ python benchmarks/group_commit.py --sizes 0,16,64 --wait-ms 2 --clients 32 --duration 5
+    $ python benchmarks/group_commit.py --database-url postgresql://... --sizes 0,64
+
+For each group commit size, --clients clients keep POSTing /favorites ("like")
+for --duration seconds, then as many clients DELETE the same favorites
+("unlike"), against a threaded server. Size 0 commits every request on its own
+(the default); every other size coalesces up to that many changes per
+transaction. Each size works on favorites no other size touched, so every like
+is a 201 and every unlike a 200 until the likes run out (then 404s, which count
+as requests, not errors).
+"""
+import argparse
+import os
+import sys
+
+from run import Scenario, run_load, start_server
+from seed import SRC, seed
+
+VOLUMES = {'users': 1000, 'characters': 5000, 'planets': 0, 'vehicles': 0, 'favorites_per_user': 0}
+
+# favorites available to each size, far more than a run can create
+PAIRS_PER_SIZE = 1000000
+
+
+def pair(offset, i):
+    """(user id, character id) of the i-th favorite of a run, all distinct."""
+    k = offset + i
+    return k % VOLUMES['users'] + 1, k // VOLUMES['users'] % VOLUMES['characters'] + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bench_group_commit.db')
+    parser.add_argument('--sizes', default='0,16,64', help='comma separated FAVORITE_GROUP_COMMIT_SIZE values')
+    parser.add_argument('--wait-ms', type=float, default=2.0, help='FAVORITE_GROUP_COMMIT_WAIT_MS for every run')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per phase')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SLOW_REQUEST_MS', '1000000')
+    # every load client comes from 127.0.0.1
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    sys.path.insert(0, SRC)
+    from app import app
+    from models import db
+    import groupcommit
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, VOLUMES)
+        dialect = db.engine.dialect.name
+    server, base_url = start_server(app)
+
+    print('%s, %d clients, %.0fs per phase, wait %.1f ms, %d CPUs'
+          % (dialect, args.clients, args.duration, args.wait_ms, os.cpu_count()))
+    print('%-6s %10s %10s %8s %10s %10s %8s %10s' % ('size', 'likes/s', 'p95 ms', 'errors', 'unlikes/s', 'p95 ms',
+                                                   'errors', 'per commit'))
+    for run, size in enumerate(int(value) for value in args.sizes.split(',')):
+        groupcommit.writer = groupcommit.GroupCommit(size, args.wait_ms)
+        offset = run * PAIRS_PER_SIZE
+        like = Scenario('like', 'POST', '/favorites', lambda i: ('/favorites', dict(
+            zip(('user_id', 'character_id'), pair(offset, i)))), True)
+        unlike = Scenario('unlike', 'DELETE', '/favorites/character/<int:id_user>/<int:id_character>',
+                          lambda i: ('/favorites/character/%d/%d' % pair(offset, i), None), True)
+        liked = run_load(base_url, like, args.clients, args.duration)
+        unliked = run_load(base_url, unlike, args.clients, args.duration)
+        stats = groupcommit.stats()
+        per_commit = '%.1f' % (stats['changes'] / stats['batches']) if stats['batches'] else '1'
+        print('%-6d %10s %10s %8d %10s %10s %8d %10s' % (
+            size, liked['throughput_rps'], liked['p95_ms'], liked['errors'],
+            unliked['throughput_rps'], unliked['p95_ms'], unliked['errors'], per_commit))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
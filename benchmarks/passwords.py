@@ -0,0 +1,78 @@
+"""
+Throughput of concurrent sign-ups and of the reads served next to them, for
+several sizes of the password hashing pool (src/passwords.py).
+
+    $ python benchmarks/passwords.py --workers 0,1,2,4 --signups 16 --readers 16 --duration 5
+
+For each pool size, --signups clients keep POSTing /users while --readers clients
+keep GETting /characters/<id>, both against the same threaded server. Pool size 0
+hashes on the request threads (no bound); 503 responses from a full queue are
+counted as errors.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from run import Scenario, run_load, start_server
+from seed import SRC, seed
+
+VOLUMES = {'users': 100, 'characters': 1000, 'planets': 0, 'vehicles': 0, 'favorites_per_user': 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bench_passwords.db')
+    parser.add_argument('--workers', default='0,1,2,4', help='comma separated pool sizes to compare')
+    parser.add_argument('--queue', type=int, default=64, help='PASSWORD_HASH_QUEUE for every run')
+    parser.add_argument('--signups', type=int, default=16, help='concurrent sign-up clients')
+    parser.add_argument('--readers', type=int, default=16, help='concurrent read clients')
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SLOW_REQUEST_MS', '1000000')
+    # every load client comes from 127.0.0.1
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    sys.path.insert(0, SRC)
+    from app import app
+    from models import db
+    import passwords
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, VOLUMES)
+    server, base_url = start_server(app)
+
+    print('scrypt n=%d r=%d p=%d, %d sign-up clients, %d read clients, %d CPUs'
+          % (passwords.current_params() + (args.signups, args.readers, os.cpu_count())))
+    print('%-8s %14s %12s %8s %14s %12s' % ('workers', 'sign-ups/s', 'p95 ms', 'errors', 'reads/s', 'p95 ms'))
+    for workers in [int(value) for value in args.workers.split(',')]:
+        passwords.pool = passwords.HashPool(workers, args.queue)
+        run_id = '%d-%d' % (workers, time.time())
+        signup = Scenario('sign-up', 'POST', '/users', lambda i: ('/users', {
+            'name': 'Signup %s %d' % (run_id, i), 'email': 'signup-%s-%d@example.com' % (run_id, i),
+            'password': 'password %d' % i}), True)
+        read = Scenario('read', 'GET', '/characters/<int:character_id>',
+                        lambda i: ('/characters/%d' % (i % VOLUMES['characters'] + 1), None), True)
+        results = {}
+        threads = [
+            threading.Thread(target=lambda: results.update(signup=run_load(base_url, signup, args.signups,
+                                                                           args.duration))),
+            threading.Thread(target=lambda: results.update(read=run_load(base_url, read, args.readers,
+                                                                         args.duration))),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print('%-8d %14s %12s %8d %14s %12s' % (
+            workers, results['signup']['throughput_rps'], results['signup']['p95_ms'],
+            results['signup']['errors'], results['read']['throughput_rps'], results['read']['p95_ms']))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
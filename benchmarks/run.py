@@ -0,0 +1,367 @@
+"""
+Reproducible benchmark of every API route.
+
+    $ python benchmarks/run.py                              # seed /tmp/bench.db and run everything
+    $ python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    $ python benchmarks/run.py --compare benchmarks/baseline.json
+    $ python benchmarks/run.py --database-url postgresql://... --reset
+
+Two phases:
+  1. every scenario is run sequentially through Flask's test client (no network),
+     which measures the cost of the handler, the ORM and the serialization;
+  2. the read scenarios are replayed by a concurrent load generator against a
+     threaded WSGI server (or against --url, e.g. a gunicorn started separately).
+
+Each scenario reports p50/p95/p99 latency and throughput; the run reports peak RSS
+of this process. --save-baseline writes the results as JSON and --compare prints
+the difference against such a file, exiting with 1 when a p95 regressed more
+than --max-regression.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from seed import SRC, GENDERS, add_volume_arguments, volumes_from_args, seed
+
+# method, url rule (to check coverage), request factory i -> (path, json body), used by the load phase
+Scenario = namedtuple('Scenario', ['name', 'method', 'rule', 'make_request', 'load'])
+
+CHARACTER = {'height': '172', 'mass': '77', 'hair_color': 'blond', 'skin_color': 'fair', 'eye_color': 'blue',
+             'birth_year': '19BBY', 'gender': 'male'}
+PLANET = {'rotation_period': '23', 'diameter': '10465', 'climate': 'arid', 'gravity': '1 standard',
+          'terrain': 'desert', 'population': '200000'}
+VEHICLE = {'model': 'Digger Crawler', 'length': '36.8', 'cargo_capacity': '50000', 'vehicle_class': 'wheeled',
+           'manufacturer': 'Corellia Mining Corporation'}
+
+
+def build_scenarios(volumes, run_id):
+    users, characters = volumes['users'], volumes['characters']
+    planets, vehicles = volumes['planets'], volumes['vehicles']
+
+    def cycle(total):
+        return lambda i: i % max(total, 1) + 1
+
+    user_of, character_of, planet_of, vehicle_of = cycle(users), cycle(characters), cycle(planets), cycle(vehicles)
+    # ids no seeded user has favorited (seeded favorites are skewed to low ids), so add/delete pairs line up
+    fresh_character = lambda i: characters - (i // max(users, 1)) % max(characters // 2, 1)
+    fresh_planet = lambda i: planets - (i // max(users, 1)) % max(planets // 2, 1)
+    fresh_vehicle = lambda i: vehicles - (i // max(users, 1)) % max(vehicles // 2, 1)
+
+    return [
+        Scenario('sitemap', 'GET', '/', lambda i: ('/', None), False),
+        Scenario('hello', 'GET', '/prueba', lambda i: ('/prueba', None), True),
+        Scenario('list users', 'GET', '/users', lambda i: ('/users', None), True),
+        Scenario('list users page', 'GET', '/users', lambda i: ('/users?after=%d&limit=100' % (i * 100 % users), None), True),
+        Scenario('get user', 'GET', '/users/<int:id>', lambda i: ('/users/%d' % user_of(i), None), True),
+        Scenario('list characters', 'GET', '/characters', lambda i: ('/characters', None), True),
+        Scenario('list characters page', 'GET', '/characters',
+                 lambda i: ('/characters?after=%d&limit=100&fields=name,gender' % (i * 100 % characters), None), True),
+        Scenario('filter characters', 'GET', '/characters',
+                 lambda i: ('/characters?gender=%s&sort=-eye_color,name&limit=50' % GENDERS[i % len(GENDERS)], None),
+                 True),
+        Scenario('search characters', 'GET', '/characters',
+                 lambda i: ('/characters?prefix=character%%20%d&limit=20' % (i % 100), None), True),
+        Scenario('popular characters', 'GET', '/characters/popular',
+                 lambda i: ('/characters/popular?limit=%d' % (10 + i % 3 * 10), None), True),
+        Scenario('related characters', 'GET', '/characters/<int:character_id>/related',
+                 lambda i: ('/characters/%d/related' % character_of(i), None), True),
+        Scenario('get characters by ids', 'GET', '/characters',
+                 lambda i: ('/characters?ids=' + ','.join(str(character_of(i * 200 + k)) for k in range(200)), None), True),
+        Scenario('get character', 'GET', '/characters/<int:character_id>',
+                 lambda i: ('/characters/%d' % character_of(i), None), True),
+        Scenario('list planets', 'GET', '/planets', lambda i: ('/planets', None), True),
+        Scenario('planet stats', 'GET', '/planets/stats',
+                 lambda i: ('/planets/stats?field=population&diameter__gte=%d' % (i % 100 * 1000), None), True),
+        Scenario('get planet', 'GET', '/planets/<int:planet_id>', lambda i: ('/planets/%d' % planet_of(i), None), True),
+        Scenario('list vehicles', 'GET', '/vehicles', lambda i: ('/vehicles', None), True),
+        Scenario('get vehicle', 'GET', '/vehicles/<int:vehicle_id>',
+                 lambda i: ('/vehicles/%d' % vehicle_of(i), None), True),
+        Scenario('get favorites', 'GET', '/favorites/<int:user_id>',
+                 lambda i: ('/favorites/%d' % user_of(i), None), True),
+        Scenario('get favorites expanded', 'GET', '/favorites/<int:user_id>',
+                 lambda i: ('/favorites/%d?expand=true' % user_of(i), None), True),
+        Scenario('export characters', 'GET', '/export/<string:model_name>',
+                 lambda i: ('/export/characters', None), False),
+        Scenario('cache stats', 'GET', '/cache/stats', lambda i: ('/cache/stats', None), False),
+        Scenario('metrics', 'GET', '/metrics', lambda i: ('/metrics', None), False),
+        Scenario('create user', 'POST', '/users', lambda i: ('/users', {
+            'name': 'Bench %s %d' % (run_id, i), 'email': 'bench-%s-%d@example.com' % (run_id, i),
+            'password': 'password'}), False),
+        Scenario('login', 'POST', '/login', lambda i: ('/login', {
+            'email': 'user%d@example.com' % user_of(i), 'password': 'password'}), False),
+        Scenario('delete user', 'DELETE', '/users/<int:id>',
+                 lambda i: ('/users/%d' % (users + i + 1), None), False),
+        Scenario('create character', 'POST', '/characters',
+                 lambda i: ('/characters', dict(CHARACTER, name='Bench %s %d' % (run_id, i))), False),
+        Scenario('bulk characters', 'POST', '/characters/bulk', lambda i: ('/characters/bulk', [
+            dict(CHARACTER, name='Bulk %s %d-%d' % (run_id, i, n)) for n in range(100)]), False),
+        Scenario('bulk planets', 'POST', '/planets/bulk', lambda i: ('/planets/bulk', [
+            dict(PLANET, name='Bulk %s %d-%d' % (run_id, i, n)) for n in range(100)]), False),
+        Scenario('bulk vehicles', 'POST', '/vehicles/bulk', lambda i: ('/vehicles/bulk', [
+            dict(VEHICLE, name='Bulk %s %d-%d' % (run_id, i, n)) for n in range(100)]), False),
+        Scenario('add favorite', 'POST', '/favorites',
+                 lambda i: ('/favorites', {'user_id': user_of(i), 'character_id': fresh_character(i)}), False),
+        Scenario('delete favorite character', 'DELETE', '/favorites/character/<int:id_user>/<int:id_character>',
+                 lambda i: ('/favorites/character/%d/%d' % (user_of(i), fresh_character(i)), None), False),
+        Scenario('bulk favorites', 'POST', '/favorites/bulk', lambda i: ('/favorites/bulk', [
+            {'user_id': user_of(i * 10 + n), 'planet_id': fresh_planet(i), 'vehicle_id': fresh_vehicle(i)}
+            for n in range(10)]), False),
+        Scenario('delete favorite planet', 'DELETE', '/favorite/planet/<int:id_user>/<int:id_planet>',
+                 lambda i: ('/favorite/planet/%d/%d' % (user_of(i * 10), fresh_planet(i)), None), False),
+        Scenario('delete favorite vehicle', 'DELETE', '/favorite/vehicle/<int:id_user>/<int:id_vehicle>',
+                 lambda i: ('/favorite/vehicle/%d/%d' % (user_of(i * 10), fresh_vehicle(i)), None), False),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+
+
+def run_sequential(client, scenario, iterations):
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        path, body = scenario.make_request(i)
+        request_started = time.perf_counter()
+        response = client.open(path, method=scenario.method, json=body)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 500:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def run_load(base_url, scenario, concurrency, duration):
+    """Keeps `concurrency` keep-alive HTTP clients busy on the scenario for `duration` seconds."""
+    parts = urlsplit(base_url)
+    deadline = time.perf_counter() + duration
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def worker():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        local = []
+        while time.perf_counter() < deadline:
+            with lock:
+                i = next(counter)
+            path, body = scenario.make_request(i)
+            payload = json.dumps(body) if body is not None else None
+            started = time.perf_counter()
+            try:
+                connection.request(scenario.method, path, body=payload,
+                                   headers={'Content-Type': 'application/json'} if payload else {})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    with lock:
+                        errors[0] += 1
+                if response.will_close:
+                    connection.close()
+                    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+                continue
+            local.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+
+def start_server(app):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class RequestHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def check_coverage(app, scenarios):
+    covered = {(scenario.rule, scenario.method) for scenario in scenarios}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static' or rule.rule.startswith('/admin'):
+            continue
+        for method in rule.methods - {'HEAD', 'OPTIONS'}:
+            if (rule.rule, method) not in covered:
+                missing.append('%s %s' % (method, rule.rule))
+    return sorted(missing)
+
+
+def compare(results, baseline, max_regression):
+    """Prints p95 / throughput deltas per scenario and returns the regressed ones."""
+    regressions = []
+    for phase in ('sequential', 'load'):
+        for name, current in results.get(phase, {}).items():
+            previous = baseline.get(phase, {}).get(name)
+            if not previous or not previous.get('p95_ms') or current.get('p95_ms') is None:
+                continue
+            change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms']
+            flag = ''
+            if change > max_regression:
+                flag = '  <-- REGRESSION'
+                regressions.append((phase, name))
+            print('%-10s %-28s p95 %9.3f -> %9.3f ms (%+6.1f%%)%s'
+                  % (phase, name, previous['p95_ms'], current['p95_ms'], change * 100, flag))
+    return regressions
+
+
+def print_table(title, results):
+    print('\n%s' % title)
+    print('%-28s %8s %6s %9s %9s %9s %10s' % ('scenario', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, result in results.items():
+        print('%-28s %8d %6d %9s %9s %9s %10s' % (name, result['requests'], result['errors'], result['p50_ms'],
+                                                   result['p95_ms'], result['p99_ms'], result['throughput_rps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bench.db')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop and re-seed the tables of --database-url (always done for the default SQLite file)')
+    add_volume_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=200, help='sequential requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients in the load phase')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario in the load phase')
+    parser.add_argument('--url', help='run the load phase against this running server instead of an in-process one')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--only', help='comma separated scenario names to run')
+    parser.add_argument('--no-cache', action='store_true', help='disable the catalog cache (CACHE_ENABLED=0)')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed relative p95 increase when comparing (default 0.25)')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SLOW_REQUEST_MS', '1000000')
+    # every load client comes from 127.0.0.1
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    if args.no_cache:
+        os.environ['CACHE_ENABLED'] = '0'
+    sys.path.insert(0, SRC)
+    from app import app
+    from models import db
+
+    volumes = volumes_from_args(args)
+    if args.reset or args.database_url == 'sqlite:////tmp/bench.db':
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(db, volumes, args.seed)
+            print('seeded %s in %.1fs: %s' % (args.database_url, time.perf_counter() - started, volumes))
+
+    scenarios = build_scenarios(volumes, run_id=str(int(time.time())))
+    missing = check_coverage(app, scenarios)
+    if missing:
+        print('warning: routes without a benchmark scenario: ' + ', '.join(missing))
+    if args.only:
+        wanted = {name.strip() for name in args.only.split(',')}
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'database': urlsplit(args.database_url).scheme,
+            'volumes': volumes,
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'cache': not args.no_cache,
+        },
+        'sequential': {},
+        'load': {},
+    }
+
+    client = app.test_client()
+    for scenario in scenarios:
+        results['sequential'][scenario.name] = run_sequential(client, scenario, args.iterations)
+    print_table('sequential (Flask test client)', results['sequential'])
+
+    if not args.skip_load:
+        server = None
+        base_url = args.url
+        if base_url is None:
+            server, base_url = start_server(app)
+        for scenario in scenarios:
+            if scenario.load:
+                results['load'][scenario.name] = run_load(base_url, scenario, args.concurrency, args.duration)
+        if server is not None:
+            server.shutdown()
+        print_table('load (%d concurrent clients, %s)' % (args.concurrency, base_url), results['load'])
+
+    results['meta']['peak_rss_mb'] = peak_rss_mb()
+    print('\npeak RSS: %s MB' % results['meta']['peak_rss_mb'])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('baseline written to %s' % args.save_baseline)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print('\ncompared with %s (commit %s)' % (args.compare, baseline.get('meta', {}).get('commit')))
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
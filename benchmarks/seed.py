@@ -0,0 +1,140 @@
+"""
+Seeds a database with synthetic users, catalog entities and favorites for the benchmarks.
+
+    $ python benchmarks/seed.py --database-url sqlite:////tmp/bench.db --characters 100000
+
+Rows are generated from a fixed random seed so two runs with the same volumes
+produce the same data, and inserted with executemany in chunks.
+"""
+import argparse
+import os
+import random
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+DEFAULT_VOLUMES = {
+    'users': 1000,
+    'characters': 5000,
+    'planets': 2000,
+    'vehicles': 2000,
+    'favorites_per_user': 10,
+}
+
+CHUNK_SIZE = 5000
+
+GENDERS = ('male', 'female', 'n/a', 'hermaphrodite')
+COLORS = ('blue', 'brown', 'yellow', 'red', 'black', 'green', 'unknown')
+CLIMATES = ('arid', 'temperate', 'tropical', 'frozen', 'murky')
+TERRAINS = ('desert', 'grasslands', 'mountains', 'jungle', 'ocean', 'tundra')
+VEHICLE_CLASSES = ('wheeled', 'repulsorcraft', 'starfighter', 'walker', 'speeder')
+
+
+def add_volume_arguments(parser):
+    for name, default in DEFAULT_VOLUMES.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=int, default=default)
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default 42)')
+
+
+def volumes_from_args(args):
+    return {name: getattr(args, name) for name in DEFAULT_VOLUMES}
+
+
+def _number(rng, low, high):
+    if rng.random() < 0.05:
+        return 'unknown'
+    return '{:,}'.format(rng.randint(low, high)) if high > 10000 else str(rng.randint(low, high))
+
+
+def _character(rng, i):
+    return {
+        'name': 'Character %d' % i, 'height': _number(rng, 60, 260), 'mass': _number(rng, 15, 1400),
+        'hair_color': rng.choice(COLORS), 'skin_color': rng.choice(COLORS), 'eye_color': rng.choice(COLORS),
+        'birth_year': '%dBBY' % rng.randint(1, 900), 'gender': rng.choice(GENDERS),
+    }
+
+
+def _planet(rng, i):
+    return {
+        'name': 'Planet %d' % i, 'rotation_period': _number(rng, 6, 60), 'diameter': _number(rng, 0, 120000),
+        'climate': rng.choice(CLIMATES), 'gravity': '%s standard' % rng.choice(('0.5', '1', '1.5', '2')),
+        'terrain': rng.choice(TERRAINS), 'population': _number(rng, 0, 10 ** 12),
+    }
+
+
+def _vehicle(rng, i):
+    return {
+        'name': 'Vehicle %d' % i, 'model': 'Model %d' % rng.randint(1, 500), 'length': _number(rng, 1, 3000),
+        'cargo_capacity': _number(rng, 0, 10 ** 8), 'vehicle_class': rng.choice(VEHICLE_CLASSES),
+        'manufacturer': 'Manufacturer %d' % rng.randint(1, 80),
+    }
+
+
+def _insert(db, model, rows):
+    from sqlalchemy import insert
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(insert(model), rows[start:start + CHUNK_SIZE])
+
+
+def seed(db, volumes, seed=42):
+    """Inserts the requested volumes into empty tables and returns them."""
+    from models import User, Character, Planet, Vehicle, FavoriteCharacter, FavoritePlanet, FavoriteVehicle
+    from passwords import make_hash
+    from popularity import reconcile_favorite_counts
+    from related import build_index
+    rng = random.Random(seed)
+
+    # one hash shared by every seeded user, hashing each of them would dominate the seeding time
+    password = make_hash('password')
+    _insert(db, User, [{'name': 'User %d' % i, 'email': 'user%d@example.com' % i, 'password': password}
+                       for i in range(1, volumes['users'] + 1)])
+    _insert(db, Character, [_character(rng, i) for i in range(1, volumes['characters'] + 1)])
+    _insert(db, Planet, [_planet(rng, i) for i in range(1, volumes['planets'] + 1)])
+    _insert(db, Vehicle, [_vehicle(rng, i) for i in range(1, volumes['vehicles'] + 1)])
+
+    favorites = {FavoriteCharacter: [], FavoritePlanet: [], FavoriteVehicle: []}
+    targets = (
+        (FavoriteCharacter, 'character_id', volumes['characters']),
+        (FavoritePlanet, 'planet_id', volumes['planets']),
+        (FavoriteVehicle, 'vehicle_id', volumes['vehicles']),
+    )
+    for user_id in range(1, volumes['users'] + 1):
+        for model, column, total in targets:
+            if not total:
+                continue
+            # skewed towards low ids so some items are much more popular than others
+            count = min(volumes['favorites_per_user'], total)
+            picked = set()
+            while len(picked) < count:
+                picked.add(min(int(rng.paretovariate(1.2)), total))
+            favorites[model] += [{'user_id': user_id, column: item_id} for item_id in sorted(picked)]
+    for model, rows in favorites.items():
+        _insert(db, model, rows)
+    db.session.commit()
+    # the favorites went in without the API, so count them in one pass
+    for model in (Character, Planet, Vehicle):
+        reconcile_favorite_counts(model, CHUNK_SIZE)
+    # and the "also favorited" index, so no measured request pays for building it
+    build_index()
+    return volumes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bench.db')
+    add_volume_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, SRC)
+    from app import app
+    from models import db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, volumes_from_args(args), args.seed)
+    print('seeded %s' % args.database_url)
+
+
+if __name__ == '__main__':
+    main()
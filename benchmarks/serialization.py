@@ -0,0 +1,78 @@
+"""
+Compares the list serialization paths on a large table.
+
+    $ python benchmarks/serialization.py --rows 100000
+
+  orm + serialize()     Character.query.all(), item.serialize() per row, Flask's default JSON provider
+  core rows             serialize_all(): public columns selected with Core, rows zipped into dicts
+  core rows + fast json serialize_all() encoded with FastJSONProvider (orjson when installed)
+
+Each path builds the full response body and is run --repeat times; the best time
+is reported along with the body size, which should be the same for all of them.
+"""
+import argparse
+import os
+import sys
+import time
+
+from seed import SRC, seed
+
+
+def best_of(repeat, fn):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bench_serialization.db')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, SRC)
+    from flask.json.provider import DefaultJSONProvider
+    from app import app
+    from models import db, Character
+    from serializers import FastJSONProvider, serialize_all, orjson
+
+    default_json = DefaultJSONProvider(app)
+    fast_json = FastJSONProvider(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, {'users': 0, 'characters': args.rows, 'planets': 0, 'vehicles': 0, 'favorites_per_user': 0})
+
+        def orm_path():
+            db.session.expunge_all()
+            body = {"msg": "ok", "results": [item.serialize() for item in Character.query.all()]}
+            return default_json.response(body).get_data()
+
+        def core_path():
+            return default_json.response({"msg": "ok", "results": serialize_all(Character)}).get_data()
+
+        def core_fast_path():
+            return fast_json.response({"msg": "ok", "results": serialize_all(Character)}).get_data()
+
+        paths = [
+            ('orm + serialize()', orm_path),
+            ('core rows', core_path),
+            ('core rows + fast json', core_fast_path),
+        ]
+        print('%d characters, best of %d, orjson %s' % (args.rows, args.repeat, 'installed' if orjson else 'missing'))
+        baseline = None
+        for name, fn in paths:
+            elapsed, payload = best_of(args.repeat, fn)
+            baseline = baseline or elapsed
+            print('%-24s %9.1f ms  %5.2fx  %d bytes' % (name, elapsed * 1000, baseline / elapsed, len(payload)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Side by side load test of the sync (gunicorn + wsgi.py) and async (uvicorn + asgi.py) servers.
+
+    $ python benchmarks/servers.py --workers 1 --concurrency 64 --duration 10
+
+Both servers are started as subprocesses on the same seeded database and every
+read scenario of run.py is replayed against each of them with the same number of
+concurrent clients.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from run import build_scenarios, run_load, print_table
+from seed import SRC, add_volume_arguments, volumes_from_args, seed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server on port %d did not start' % port)
+
+
+def server_commands(port, workers):
+    bind = '127.0.0.1:%d' % port
+    return {
+        'wsgi (gunicorn sync)': ['gunicorn', 'wsgi:application', '--chdir', SRC, '--bind', bind,
+                                 '--workers', str(workers), '--log-level', 'warning'],
+        'asgi (uvicorn)': ['uvicorn', 'asgi:application', '--app-dir', SRC, '--host', '127.0.0.1',
+                           '--port', str(port), '--workers', str(workers), '--log-level', 'warning',
+                           '--no-access-log'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bench.db')
+    parser.add_argument('--reset', action='store_true', help='drop and re-seed --database-url')
+    add_volume_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--only', help='comma separated scenario names to run')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SLOW_REQUEST_MS', '1000000')
+    # every load client comes from 127.0.0.1
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    volumes = volumes_from_args(args)
+    if args.reset or args.database_url == 'sqlite:////tmp/bench.db':
+        sys.path.insert(0, SRC)
+        from app import app
+        from models import db
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed(db, volumes, args.seed)
+
+    scenarios = [scenario for scenario in build_scenarios(volumes, run_id='servers') if scenario.load]
+    if args.only:
+        wanted = {name.strip() for name in args.only.split(',')}
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+    port = free_port()
+    for name, command in server_commands(port, args.workers).items():
+        server = subprocess.Popen(command, env=os.environ.copy())
+        try:
+            wait_for_port(port)
+            base_url = 'http://127.0.0.1:%d' % port
+            results = {scenario.name: run_load(base_url, scenario, args.concurrency, args.duration)
+                       for scenario in scenarios}
+        finally:
+            server.terminate()
+            server.wait()
+        print_table('%s, %d worker(s), %d concurrent clients' % (name, args.workers, args.concurrency), results)
+
+
+if __name__ == '__main__':
+    main()
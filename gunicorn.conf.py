@@ -0,0 +1,17 @@
+"""
+Gunicorn settings, read from the directory gunicorn is started in (the Procfile
+and render.yaml run `gunicorn wsgi --chdir ./src/` from the repository root, so
+this file is picked up without -c; src/ is on the path by the time the hooks run).
+
+Every worker warms up (see startup.py) before it accepts its first request. With
+GUNICORN_PRELOAD=1 the app is imported once in the master and the workers are
+forked from it, which makes starting and replacing workers much faster.
+"""
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+
+def post_worker_init(worker):
+    from startup import warm_up
+    worker.log.info('worker %s ready: %s', worker.pid, warm_up(worker.wsgi))
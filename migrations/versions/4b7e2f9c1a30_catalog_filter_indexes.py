@@ -0,0 +1,47 @@
+"""indexes for filtering and name search on the catalog
+
+Revision ID: 4b7e2f9c1a30
+Revises: dea4b66b56eb
+Create Date: 2026-10-18 11:02:13.540118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2f9c1a30'
+down_revision = 'dea4b66b56eb'
+branch_labels = None
+depends_on = None
+
+FILTER_COLUMNS = (
+    ('character', ('hair_color', 'skin_color', 'eye_color', 'gender')),
+    ('planet', ('climate', 'terrain')),
+    ('vehicle', ('vehicle_class', 'manufacturer')),
+)
+
+CATALOG_TABLES = ('character', 'planet', 'vehicle')
+
+
+def upgrade():
+    for table, columns in FILTER_COLUMNS:
+        for column in columns:
+            op.create_index(op.f('ix_{}_{}'.format(table, column)), table, [column], unique=False)
+
+    for table in CATALOG_TABLES:
+        op.create_index('ix_{}_name_lower'.format(table), table, [sa.text('lower(name)')], unique=False)
+        if op.get_bind().dialect.name == 'postgresql':
+            op.create_index('ix_{}_name_search'.format(table), table, [sa.text("to_tsvector('simple', name)")],
+                            unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    for table in reversed(CATALOG_TABLES):
+        if op.get_bind().dialect.name == 'postgresql':
+            op.drop_index('ix_{}_name_search'.format(table), table_name=table)
+        op.drop_index('ix_{}_name_lower'.format(table), table_name=table)
+
+    for table, columns in reversed(FILTER_COLUMNS):
+        for column in reversed(columns):
+            op.drop_index(op.f('ix_{}_{}'.format(table, column)), table_name=table)
@@ -0,0 +1,46 @@
+"""favorites cascade on delete of their user or catalog entity
+
+Revision ID: 5d2a9e7c3b18
+Revises: 8c1d5e0f7b42
+Create Date: 2026-10-18 12:40:11.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a9e7c3b18'
+down_revision = '8c1d5e0f7b42'
+branch_labels = None
+depends_on = None
+
+FAVORITE_FOREIGN_KEYS = (
+    ('favorite_character', (('user_id', 'user'), ('character_id', 'character'))),
+    ('favorite_planet', (('user_id', 'user'), ('planet_id', 'planet'))),
+    ('favorite_vehicle', (('user_id', 'user'), ('vehicle_id', 'vehicle'))),
+)
+
+# the first revision created these constraints without names; on SQLite batch mode
+# gives them this name so they can be dropped (other databases reflect their own)
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def _replace_foreign_keys(ondelete):
+    inspector = sa.inspect(op.get_bind())
+    for table, columns in FAVORITE_FOREIGN_KEYS:
+        reflected = {tuple(fk['constrained_columns']): fk['name'] for fk in inspector.get_foreign_keys(table)}
+        # favorite tables aren't referenced by anything, so SQLite can rebuild them with foreign_keys on
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referred in columns:
+                name = 'fk_%s_%s_%s' % (table, column, referred)
+                batch_op.drop_constraint(reflected.get((column,)) or name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(None)
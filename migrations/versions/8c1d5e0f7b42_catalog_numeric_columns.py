@@ -0,0 +1,72 @@
+"""numeric copies of the catalog measurements
+
+Revision ID: 8c1d5e0f7b42
+Revises: 4b7e2f9c1a30
+Create Date: 2026-10-18 11:48:37.201946
+
+"""
+import math
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1d5e0f7b42'
+down_revision = '4b7e2f9c1a30'
+branch_labels = None
+depends_on = None
+
+NUMERIC_COLUMNS = (
+    ('character', ('height', 'mass')),
+    ('planet', ('rotation_period', 'diameter', 'population')),
+    ('vehicle', ('length', 'cargo_capacity')),
+)
+
+BATCH_SIZE = 1000
+
+
+def parse_measure(value):
+    # same rules as src/measures.py at the time of this revision
+    try:
+        number = float(str(value).strip().replace(',', ''))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def backfill(table, columns):
+    """Fills the new columns BATCH_SIZE rows at a time, walking the table by id."""
+    connection = op.get_bind()
+    source = sa.table(table, sa.column('id'), *(sa.column(column) for column in columns),
+                      *(sa.column(column + '_num') for column in columns))
+    statement = sa.update(source).where(source.c.id == sa.bindparam('row_id')).values(
+        {column + '_num': sa.bindparam(column + '_value') for column in columns})
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(source.c.id, *(source.c[column] for column in columns))
+            .where(source.c.id > last_id).order_by(source.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            return
+        connection.execute(statement, [
+            dict({'row_id': row.id}, **{column + '_value': parse_measure(row._mapping[column]) for column in columns})
+            for row in rows])
+        last_id = rows[-1].id
+
+
+def upgrade():
+    for table, columns in NUMERIC_COLUMNS:
+        for column in columns:
+            op.add_column(table, sa.Column(column + '_num', sa.Float(), nullable=True))
+        backfill(table, columns)
+        for column in columns:
+            op.create_index(op.f('ix_{}_{}_num'.format(table, column)), table, [column + '_num'], unique=False)
+
+
+def downgrade():
+    # plain ALTER TABLE (SQLite >= 3.35): batch mode would rebuild the table and lose the
+    # lower(name) expression indexes, which SQLite can't reflect
+    for table, columns in reversed(NUMERIC_COLUMNS):
+        for column in reversed(columns):
+            op.drop_index(op.f('ix_{}_{}_num'.format(table, column)), table_name=table)
+            op.drop_column(table, column + '_num')
@@ -0,0 +1,39 @@
+"""favorite counts on the catalog tables
+
+Revision ID: a3f6c8e1d2b7
+Revises: 5d2a9e7c3b18
+Create Date: 2026-10-18 13:22:47.903114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f6c8e1d2b7'
+down_revision = '5d2a9e7c3b18'
+branch_labels = None
+depends_on = None
+
+FAVORITE_TABLES = (
+    ('character', 'favorite_character', 'character_id'),
+    ('planet', 'favorite_planet', 'planet_id'),
+    ('vehicle', 'favorite_vehicle', 'vehicle_id'),
+)
+
+
+def upgrade():
+    for table, favorite_table, foreign_key in FAVORITE_TABLES:
+        op.add_column(table, sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+        op.create_index(op.f('ix_%s_favorite_count' % table), table, ['favorite_count'], unique=False)
+        catalog = sa.table(table, sa.column('id'), sa.column('favorite_count'))
+        favorite = sa.table(favorite_table, sa.column(foreign_key))
+        actual = (sa.select(sa.func.count()).select_from(favorite)
+                  .where(favorite.c[foreign_key] == catalog.c.id).scalar_subquery())
+        op.execute(catalog.update().values(favorite_count=actual))
+
+
+def downgrade():
+    for table, _, _ in FAVORITE_TABLES:
+        op.drop_index(op.f('ix_%s_favorite_count' % table), table_name=table)
+        op.drop_column(table, 'favorite_count')
@@ -0,0 +1,47 @@
+"""unique (user, item) indexes on favorites and name indexes on the catalog
+
+Revision ID: dea4b66b56eb
+Revises: c341cdda6782
+Create Date: 2026-10-18 10:20:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dea4b66b56eb'
+down_revision = 'c341cdda6782'
+branch_labels = None
+depends_on = None
+
+FAVORITE_TABLES = (
+    ('favorite_character', 'character_id'),
+    ('favorite_planet', 'planet_id'),
+    ('favorite_vehicle', 'vehicle_id'),
+)
+
+
+def upgrade():
+    for table, item_column in FAVORITE_TABLES:
+        # drop repeated favorites (keeping the oldest) so the unique index can be built
+        op.execute(
+            "DELETE FROM {table} WHERE id NOT IN ("
+            "SELECT id FROM (SELECT MIN(id) AS id FROM {table} GROUP BY user_id, {item}) AS keep)"
+            .format(table=table, item=item_column))
+        op.create_index('ix_{}_user_id_{}'.format(table, item_column), table, ['user_id', item_column], unique=True)
+        op.create_index(op.f('ix_{}_{}'.format(table, item_column)), table, [item_column], unique=False)
+
+    op.create_index(op.f('ix_character_name'), 'character', ['name'], unique=False)
+    op.create_index(op.f('ix_planet_name'), 'planet', ['name'], unique=False)
+    op.create_index(op.f('ix_vehicle_name'), 'vehicle', ['name'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_vehicle_name'), table_name='vehicle')
+    op.drop_index(op.f('ix_planet_name'), table_name='planet')
+    op.drop_index(op.f('ix_character_name'), table_name='character')
+
+    for table, item_column in reversed(FAVORITE_TABLES):
+        op.drop_index(op.f('ix_{}_{}'.format(table, item_column)), table_name=table)
+        op.drop_index('ix_{}_user_id_{}'.format(table, item_column), table_name=table)
@@ -0,0 +1,34 @@
+"""text_pattern_ops indexes for the name prefix search on PostgreSQL
+
+Revision ID: e7b3c94a6f15
+Revises: a3f6c8e1d2b7
+Create Date: 2026-10-18 14:05:32.417820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c94a6f15'
+down_revision = 'a3f6c8e1d2b7'
+branch_labels = None
+depends_on = None
+
+CATALOG_TABLES = ('character', 'planet', 'vehicle')
+
+
+def upgrade():
+    # other databases answer the prefix search with ix_<table>_name_lower
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in CATALOG_TABLES:
+        op.create_index('ix_{}_name_pattern'.format(table), table, [sa.text('lower(name) text_pattern_ops')],
+                        unique=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in reversed(CATALOG_TABLES):
+        op.drop_index('ix_{}_name_pattern'.format(table), table_name=table)
@@ -1,30 +1,74 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
+import startup
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from sqlalchemy.exc import IntegrityError
+from flask import Flask, Response, request, jsonify, url_for
 from flask_cors import CORS
 from utils import APIException, generate_sitemap
-from admin import setup_admin
 from models import db, User, Character, Planet, Vehicle, FavoriteCharacter, FavoritePlanet, FavoriteVehicle
+from pagination import parse_page_args, fetch_page
+from lookup import parse_ids, fetch_by_ids
+from stats import parse_stats_args, stats_key, fetch_stats
+from commands import catalog_cli
+import passwords
+from passwords import PasswordPoolBusy, hash_password, verify_password, needs_rehash
+import ratelimit
+from compression import init_compression
+import compression
+from serializers import FastJSONProvider, serialize_one, serialize_all
+from favorites import load_expanded_favorites
+from popularity import parse_popular_args, fetch_popular
+from groupcommit import GroupCommitBusy, save_favorite, remove_favorite
+import groupcommit
+from related import parse_related_args, fetch_related
+from bulk import read_items, bulk_create, bulk_create_favorites, read_ids, bulk_delete, delete_with_favorites
+from export import EXPORTABLE_MODELS, wants_ndjson, export_response
+from imports import start_upload_import, resume_import, load_job, job_to_dict
+from events import track_writes
+import cache
+from versions import conditional
+from metrics import init_metrics, register_stats, render_metrics
+from config import database_url, engine_options, configure_engine
+from routing import init_replicas, read_only
 #from models import Person
+startup.mark('imports')
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+app.json = FastJSONProvider(app)
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-MIGRATE = Migrate(app, db)
+#Flask-Migrate (y alembic) solo hace falta para los comandos `flask db`; los workers no lo importan
+if os.environ.get('FLASK_RUN_FROM_CLI'):
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db)
 db.init_app(app)
+with app.app_context():
+    configure_engine(db.engine)
+init_replicas(app)
+track_writes(db.session)
 CORS(app)
-setup_admin(app)
+init_metrics(app)
+ratelimit.init_rate_limit(app)
+init_compression(app)
+register_stats('cache', cache.stats)
+register_stats('compressed_cache', compression.cache_stats)
+register_stats('password_hash', passwords.stats)
+register_stats('rate_limit', ratelimit.stats)
+register_stats('group_commit', groupcommit.stats)
+register_stats('startup', startup.stats)
+app.cli.add_command(catalog_cli)
+startup.mark('app')
+#El admin solo se carga en los nodos que lo sirven (SERVER_ROLE=api o ENABLE_ADMIN=0 lo omiten)
+if startup.admin_enabled():
+    from admin import setup_admin
+    setup_admin(app)
+    startup.mark('admin')
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -48,14 +92,24 @@ def handle_hello():
 
 #-----------------------USER------------------------------------
 #Obtiene información de todos los usuarios
+#Con ?after=<id>&limit=N&fields=name,email devuelve una pagina y el cursor de la siguiente
+#Con ?ids=1,5,9 devuelve esos usuarios (en ese orden) con una sola consulta
 @app.route('/users', methods=['GET'])
+@read_only
+@conditional('user')
 def get_users():
+    if wants_ndjson():
+        return export_response(User)
+    ids_args = parse_ids(User, request.args)
+    page = parse_page_args(User, request.args) if ids_args is None else None
     try:
-        #consultar al modelo todos los registros de usuarios
-        query_results= User.query.all()
-        #print(query_results)  #[<User 'Pepita'>, <User 'Lolita'>] se obtiene un array y para procesarlo y trabajar con esa info del array lo recorremos con el map
-        results = list(map(lambda item: item.serialize(), query_results)) #al map en python le tenemos que pasar 2 valores primero la funcion lambda con su parametro item y a este parametro yo le voy a decir cada vez que te posiciones sobre ese valor que se esta consultando aplicale el metodo serialize() y en el segundo valor vendria a ser nombre del array que yo quiero que recorra 
-        #print(results)#<map object at 0x79991ab0f1c0>  me arroja un valor ilegible por eso se tiene que castear(formatear) usando el list (envolviendo todo el map)
+        if ids_args is not None:
+            return jsonify(fetch_by_ids(User, 'user', ids_args)), 200
+        if page is not None:
+            return jsonify(fetch_page(User, page)), 200
+        #consultar al modelo todos los registros de usuarios: se seleccionan solo las columnas publicas
+        #y cada fila se convierte directo en diccionario, sin crear objetos del ORM ni llamar a serialize()
+        results = serialize_all(User)
         if results:    
             response_body = {
                 "msg": "ok",
@@ -68,16 +122,16 @@ def get_users():
     
 #Obtiene la información de un solo usuario según su id
 @app.route('/users/<int:id>', methods=['GET'])
+@read_only
+@conditional('user')
 def get_user(id):
-    print(id)#1
     try:
-        query_user = User.query.filter_by(id=id).first()
-        #print(query_user.serialize())
-        if query_user is None:
+        result = serialize_one(User, id)
+        if result is None:
             return jsonify({'error':'User not found'}),404
         response_body = {
             "msg" : "ok",
-            "result":query_user.serialize()
+            "result":result
         }
         return jsonify(response_body),200
     except Exception as e:
@@ -93,18 +147,26 @@ def create_user():
 
         if not email or not password or not name:
             return jsonify({'error': 'Email, password and Name are required.'}), 400
+        #El hash necesita texto: un numero o una lista no se puede codificar
+        if not all(isinstance(value, str) for value in (email, password, name)):
+            return jsonify({'error': 'Email, password and Name must be strings.'}), 400
 
-        existing_user = User.query.filter_by(email=email).first()
-        if existing_user:
-            return jsonify({'error': 'Email already exists.'}), 409
-
-        # password_hash = bcrypt.generate_password_hash(password).decode('utf-8') 
+        # El hash (scrypt) se calcula en un pool acotado, ver passwords.py
+        try:
+            password_hash = hash_password(password)
+        except PasswordPoolBusy as busy:
+            return jsonify(busy.to_dict()), 503, {'Retry-After': '1'}
 
         # Ensamblamos el usuario nuevo
-        new_user = User(email=email, password=password, name=name)
+        new_user = User(email=email, password=password_hash, name=name)
 
+        #El email tiene una restriccion unica, asi que no hace falta consultarlo antes de insertar
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Email already exists.'}), 409
 
         good_to_share_user = {
             'id': new_user.id,
@@ -117,31 +179,85 @@ def create_user():
     except Exception as e:
         return jsonify({'error': 'Error in user creation: ' + str(e)}), 500
 
+#Inicia sesion con email y contraseña. Si el hash se hizo con otros parametros se recalcula y se guarda
+@app.route('/login', methods=['POST'])
+def login():
+    try:
+        body = request.get_json(silent=True) or {}
+        email = body.get('email')
+        password = body.get('password')
+
+        if not email or not password:
+            return jsonify({'error': 'Email and password are required.'}), 400
+        if not isinstance(email, str) or not isinstance(password, str):
+            return jsonify({'error': 'Email and password must be strings.'}), 400
+
+        user = User.query.filter_by(email=email).first()
+        try:
+            valid = verify_password(password, user.password if user else None)
+        except PasswordPoolBusy as busy:
+            return jsonify(busy.to_dict()), 503, {'Retry-After': '1'}
+        if not valid:
+            return jsonify({'error': 'Invalid email or password.'}), 401
+
+        if needs_rehash(user.password):
+            try:
+                user.password = hash_password(password)
+                db.session.commit()
+            except PasswordPoolBusy:
+                pass  # se vuelve a intentar en el proximo login
+
+        return jsonify({'message': 'Login successful.', 'user': {
+            'id': user.id,
+            'name': user.name,
+            'email': user.email,
+        }}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in login: ' + str(e)}), 500
+
 #Elimina un usuario por su id 
 @app.route('/users/<int:id>', methods=['DELETE'])
 def delete_user(id):
     try:
-        #Buscamos al usuario por el ID
-        user = User.query.get(id)
-        if not user:
+        #Eliminamos al usuario y sus favoritos con un DELETE por tabla, sin cargarlos
+        if not delete_with_favorites(User, [id]):
             return jsonify({'error':'User not found'}),404
-        #Eliminamos al usuario
-        db.session.delete(user)
         #Confirmamos  y subimos los cambios
         db.session.commit()
         return jsonify({'message':'User deleted successfully'}),200
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error':'Internal server error', 'message': str(e)}),500
 
+#Contadores de la cache de personajes, planetas y vehiculos (hits, misses, evictions)
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache.stats()), 200
+
+#Metricas en formato Prometheus: latencia por endpoint, consultas SQL por request, serializacion y cache
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 #-----------------------------PERSONAJES--------------------------
 #Obtiene todos los personajes
 @app.route('/characters', methods=['GET'])
+@read_only
+@conditional('character')
 def get_characters():
+    if wants_ndjson():
+        return export_response(Character)
+    ids_args = parse_ids(Character, request.args)
+    page = parse_page_args(Character, request.args) if ids_args is None else None
     try:
-        characters_results=Character.query.all()
-        #print(characters_results)
-        results = list(map(lambda item: item.serialize(), characters_results))
+        if ids_args is not None:
+            return jsonify(fetch_by_ids(Character, 'character', ids_args)), 200
+        if page is not None:
+            return jsonify(cache.cached('character:page:' + page.key(), lambda: fetch_page(Character, page))), 200
+        results = cache.cached('character:list', lambda: serialize_all(Character))
         #print(results)
         if results:    
             response_body = {
@@ -154,24 +270,60 @@ def get_characters():
     except Exception as e:
         return jsonify({'error':'Internal server error', 'message': str(e)}),500
     
+#Estadisticas (count, min, max, avg, sum) de una medida numerica, ej. ?field=height, con los mismos filtros que la lista
+@app.route('/characters/stats', methods=['GET'])
+@read_only
+@conditional('character')
+def get_character_stats():
+    stats_args = parse_stats_args(Character, request.args)
+    try:
+        return jsonify(cache.cached('character:stats:' + stats_key(stats_args), lambda: fetch_stats(Character, stats_args))), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
+#Los personajes con mas favoritos (?limit=10, maximo 100), leidos del contador con un indice
+@app.route('/characters/popular', methods=['GET'])
+@read_only
+@conditional('character', 'favorite_character')
+def get_popular_characters():
+    limit = parse_popular_args(request.args)
+    try:
+        return jsonify(fetch_popular(Character, limit)), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
 #Obtiene informacion de un solo personaje por su id    
 
 @app.route('/characters/<int:character_id>', methods=['GET'])
+@read_only
+@conditional('character')
 def get_character(character_id):
-    print(character_id)#1
     try:
-        query_character = Character.query.filter_by(id=character_id).first()
-        print(query_character.serialize())
-        if query_character is None:
+        #se consulta la cache primero y solo se va a la base de datos si no esta
+        result = cache.cached('character:%d' % character_id, lambda: serialize_one(Character, character_id))
+        if result is None:
             return jsonify({'error':'Character not found'}),404
         response_body = {
             "msg" : "ok",
-            "result":query_character.serialize()
+            "result":result
         }
         return jsonify(response_body),200
     except Exception as e:
         return jsonify({'error':'Internal server error', 'message': str(e)}),500
 
+#Los usuarios que marcaron este personaje como favorito tambien marcaron... (?limit=10)
+@app.route('/characters/<int:character_id>/related', methods=['GET'])
+@read_only
+def get_related_characters(character_id):
+    limit = parse_related_args(request.args)
+    try:
+        result = fetch_related('character', character_id, limit)
+        if result is None:
+            return jsonify({'error':'Character not found'}),404
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
 #Ruta POST new character  para crear nuevo personaje
 @app.route('/characters', methods=['POST'])
 def create_character():
@@ -216,14 +368,43 @@ def create_character():
     except Exception as e:
         return jsonify({'error': 'Error in Character creation: ' + str(e)}), 500
 
+#Crea muchos personajes de una vez (array JSON o NDJSON) en una sola transaccion
+@app.route('/characters/bulk', methods=['POST'])
+def create_characters_bulk():
+    items = read_items()
+    try:
+        report = bulk_create(Character, items)
+        return jsonify(report), 201 if report['created'] else 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in bulk Character creation: ' + str(e)}), 500
+
+#Elimina varios personajes por id junto con los favoritos que los referencian
+@app.route('/characters/bulk', methods=['DELETE'])
+def delete_characters_bulk():
+    ids = read_ids()
+    try:
+        return jsonify(bulk_delete(Character, ids)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in bulk Character deletion: ' + str(e)}), 500
+
 #-----------------------------PLANETAS--------------------------
 #Obtiene todos los planetas
 @app.route('/planets', methods=['GET'])
+@read_only
+@conditional('planet')
 def get_planets():
+    if wants_ndjson():
+        return export_response(Planet)
+    ids_args = parse_ids(Planet, request.args)
+    page = parse_page_args(Planet, request.args) if ids_args is None else None
     try:
-        planets_results = Planet.query.all()
-        # print(planets_results)
-        results = list(map(lambda item: item.serialize(), planets_results))
+        if ids_args is not None:
+            return jsonify(fetch_by_ids(Planet, 'planet', ids_args)), 200
+        if page is not None:
+            return jsonify(cache.cached('planet:page:' + page.key(), lambda: fetch_page(Planet, page))), 200
+        results = cache.cached('planet:list', lambda: serialize_all(Planet))
         # print(results)
         if results:
             response_body = {
@@ -235,31 +416,96 @@ def get_planets():
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
+#Estadisticas (count, min, max, avg, sum) de una medida numerica, ej. ?field=population, con los mismos filtros que la lista
+@app.route('/planets/stats', methods=['GET'])
+@read_only
+@conditional('planet')
+def get_planet_stats():
+    stats_args = parse_stats_args(Planet, request.args)
+    try:
+        return jsonify(cache.cached('planet:stats:' + stats_key(stats_args), lambda: fetch_stats(Planet, stats_args))), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
+#Los planetas con mas favoritos (?limit=10, maximo 100), leidos del contador con un indice
+@app.route('/planets/popular', methods=['GET'])
+@read_only
+@conditional('planet', 'favorite_planet')
+def get_popular_planets():
+    limit = parse_popular_args(request.args)
+    try:
+        return jsonify(fetch_popular(Planet, limit)), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
 #Obtiene informacion de un solo planeta
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@read_only
+@conditional('planet')
 def get_planet(planet_id):
     # print(planet_id)
     try:
-        query_planet = Planet.query.filter_by(id = planet_id).first()
-        # print(query_planet.serialize())
-        if query_planet is None:
+        result = cache.cached('planet:%d' % planet_id, lambda: serialize_one(Planet, planet_id))
+        if result is None:
             return jsonify({'error': 'Planet not found'}), 404
         response_body = {
             "msg": "ok",
-            "result": query_planet.serialize()
+            "result": result
         }
         return jsonify(response_body), 200
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
+#Los usuarios que marcaron este planeta como favorito tambien marcaron... (?limit=10)
+@app.route('/planets/<int:planet_id>/related', methods=['GET'])
+@read_only
+def get_related_planets(planet_id):
+    limit = parse_related_args(request.args)
+    try:
+        result = fetch_related('planet', planet_id, limit)
+        if result is None:
+            return jsonify({'error':'Planet not found'}),404
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
+#Crea muchos planetas de una vez (array JSON o NDJSON) en una sola transaccion
+@app.route('/planets/bulk', methods=['POST'])
+def create_planets_bulk():
+    items = read_items()
+    try:
+        report = bulk_create(Planet, items)
+        return jsonify(report), 201 if report['created'] else 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in bulk Planet creation: ' + str(e)}), 500
+
+#Elimina varios planetas por id junto con los favoritos que los referencian
+@app.route('/planets/bulk', methods=['DELETE'])
+def delete_planets_bulk():
+    ids = read_ids()
+    try:
+        return jsonify(bulk_delete(Planet, ids)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in bulk Planet deletion: ' + str(e)}), 500
+
 #-----------------------------VEHICULOS--------------------------
 #Obtiene todos los vehiculos
 @app.route('/vehicles', methods=['GET'])
+@read_only
+@conditional('vehicle')
 def get_vehicles():
+    if wants_ndjson():
+        return export_response(Vehicle)
+    ids_args = parse_ids(Vehicle, request.args)
+    page = parse_page_args(Vehicle, request.args) if ids_args is None else None
     try:
-        vehicles_results = Vehicle.query.all()
-        # print(vehicles_results)
-        results = list(map(lambda item: item.serialize(), vehicles_results))
+        if ids_args is not None:
+            return jsonify(fetch_by_ids(Vehicle, 'vehicle', ids_args)), 200
+        if page is not None:
+            return jsonify(cache.cached('vehicle:page:' + page.key(), lambda: fetch_page(Vehicle, page))), 200
+        results = cache.cached('vehicle:list', lambda: serialize_all(Vehicle))
         # print(results)
         if results:
             response_body = {
@@ -271,28 +517,97 @@ def get_vehicles():
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
     
+#Estadisticas (count, min, max, avg, sum) de una medida numerica, ej. ?field=length, con los mismos filtros que la lista
+@app.route('/vehicles/stats', methods=['GET'])
+@read_only
+@conditional('vehicle')
+def get_vehicle_stats():
+    stats_args = parse_stats_args(Vehicle, request.args)
+    try:
+        return jsonify(cache.cached('vehicle:stats:' + stats_key(stats_args), lambda: fetch_stats(Vehicle, stats_args))), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
+#Los vehiculos con mas favoritos (?limit=10, maximo 100), leidos del contador con un indice
+@app.route('/vehicles/popular', methods=['GET'])
+@read_only
+@conditional('vehicle', 'favorite_vehicle')
+def get_popular_vehicles():
+    limit = parse_popular_args(request.args)
+    try:
+        return jsonify(fetch_popular(Vehicle, limit)), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
 #Obtiene informacion de un solo vehiculo
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
+@read_only
+@conditional('vehicle')
 def get_vehicle(vehicle_id):
     # print(vehicle_id)
     try:
-        query_vehicle = Vehicle.query.filter_by(id = vehicle_id).first()
-        # print(query_vehicle.serialize())
-        if query_vehicle is None:
+        result = cache.cached('vehicle:%d' % vehicle_id, lambda: serialize_one(Vehicle, vehicle_id))
+        if result is None:
             return jsonify({'error': 'Vehicle not found'}), 404
         response_body = {
             "msg": "ok",
-            "result": query_vehicle.serialize()
+            "result": result
         }
         return jsonify(response_body), 200
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
+#Los usuarios que marcaron este vehiculo como favorito tambien marcaron... (?limit=10)
+@app.route('/vehicles/<int:vehicle_id>/related', methods=['GET'])
+@read_only
+def get_related_vehicles(vehicle_id):
+    limit = parse_related_args(request.args)
+    try:
+        result = fetch_related('vehicle', vehicle_id, limit)
+        if result is None:
+            return jsonify({'error':'Vehicle not found'}),404
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
+#Crea muchos vehiculos de una vez (array JSON o NDJSON) en una sola transaccion
+@app.route('/vehicles/bulk', methods=['POST'])
+def create_vehicles_bulk():
+    items = read_items()
+    try:
+        report = bulk_create(Vehicle, items)
+        return jsonify(report), 201 if report['created'] else 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in bulk Vehicle creation: ' + str(e)}), 500
+
+#Elimina varios vehiculos por id junto con los favoritos que los referencian
+@app.route('/vehicles/bulk', methods=['DELETE'])
+def delete_vehicles_bulk():
+    ids = read_ids()
+    try:
+        return jsonify(bulk_delete(Vehicle, ids)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error in bulk Vehicle deletion: ' + str(e)}), 500
+
 #-----------------------------FAVORITOS--------------------------
 #Obtiene todos los favoritos de un usuario segun su id
+#Con ?expand=true incluye los datos completos de cada personaje, planeta y vehiculo en una sola consulta
 @app.route('/favorites/<int:user_id>')
+@read_only
+@conditional('user', 'favorite_character', 'favorite_planet', 'favorite_vehicle', 'character', 'planet', 'vehicle')
 def get_fav(user_id):
+    expand = request.args.get('expand', '').lower() in ('1', 'true', 'yes')
     try:
+        if expand:
+            response_body = load_expanded_favorites(user_id)
+            if response_body is None:
+                return jsonify({"error": "User not found. Please enter a valid user ID to view their favorites."}), 404
+            if not any(response_body.values()):
+                return jsonify({'message': 'Favorites not found'}), 404
+            return jsonify(response_body), 200
+
         user = User.query.get(user_id)
         if not user:
             return jsonify({"error": "User not found. Please enter a valid user ID to view their favorites."}), 404
@@ -327,10 +642,6 @@ def add_favorite():
         if not  user_id_new :
             return jsonify({"message":"Please enter a user ID"}), 400
         
-        user = User.query.get(user_id_new)
-        if not user:
-            return jsonify({"error": "User not found. Please enter a valid user ID to view their favorites."}), 404
-        
         character_id_new = request.json.get("character_id")
         planet_id_new = request.json.get("planet_id")
         vehicle_id_new = request.json.get("vehicle_id")
@@ -342,29 +653,33 @@ def add_favorite():
         if character_id_new:
             #Creando y guardando un nuevo favorito
             new_fav = FavoriteCharacter(user_id = user_id_new, character_id = character_id_new)
-            db.session.add(new_fav)
-            db.session.commit()
-            response_body = new_fav.serialize()
-            return jsonify(response_body), 201
-        
         elif planet_id_new:
             new_fav = FavoritePlanet(user_id = user_id_new, planet_id = planet_id_new)
-            db.session.add(new_fav)
-            db.session.commit()
-            response_body = new_fav.serialize()
-            return jsonify(response_body), 201
-        
         elif vehicle_id_new:
             new_fav = FavoriteVehicle(user_id= user_id_new, vehicle_id=vehicle_id_new)
-            db.session.add(new_fav)
-            db.session.commit()
-            response_body = new_fav.serialize()
-            return jsonify(response_body), 201
         else:
             # Se mando un user id, pero no me mandaste que se debe favoritear
             return jsonify({"message":"You entered the user ID, but you haven't indicated which ID you want to mark as a favorite."}), 400
 
+        #Se guarda en esta peticion o, con FAVORITE_GROUP_COMMIT_SIZE, junto con los favoritos
+        #de otras peticiones en una sola transaccion (ver groupcommit.py)
+        response_body, status = save_favorite(new_fav)
+        return jsonify(response_body), status
+
+    except GroupCommitBusy as busy:
+        return jsonify(busy.to_dict()), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
+
+#Agrega muchos favoritos de una vez; cada item puede traer character_id, planet_id y vehicle_id
+@app.route('/favorites/bulk', methods=['POST'])
+def add_favorites_bulk():
+    items = read_items()
+    try:
+        report = bulk_create_favorites(items)
+        return jsonify(report), 201 if report['created'] else 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
 #Elimina un personaje favorito de cada usuario segun su id
@@ -372,22 +687,14 @@ def add_favorite():
 @app.route('/favorites/character/<int:id_user>/<int:id_character>',methods =['DELETE'])
 def delete_fav_character(id_user, id_character):
     try:
-        #Primero verificamos que los id de usuario y de caracter existan para continuar con la busqueda
-        user = User.query.get(id_user)
-        character = Character.query.get(id_character)
-
-        if not user or not character:
-            return jsonify({"error": "The user or character does not exist. Please enter valid ID values."}), 404
-
-        favorite_character = FavoriteCharacter.query.filter_by(user_id = id_user, character_id = id_character).first()
-        if not favorite_character:
+        #Un solo DELETE por (usuario, favorito), o en grupo con FAVORITE_GROUP_COMMIT_SIZE
+        deleted = remove_favorite(FavoriteCharacter(user_id = id_user, character_id = id_character))
+        if not deleted:
             return jsonify({'error': 'Character not found in their favorites'}), 404
-        
-        #Eliminando el favorito de la base de datos (db) 
-        db.session.delete(favorite_character)
-        db.session.commit()
         return jsonify({'message': 'Favorite character deleted successfully'}), 200
 
+    except GroupCommitBusy as busy:
+        return jsonify(busy.to_dict()), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
@@ -395,19 +702,13 @@ def delete_fav_character(id_user, id_character):
 @app.route('/favorite/planet/<int:id_user>/<int:id_planet>', methods = ['DELETE'])
 def delete_fav_planet(id_user, id_planet):
     try:
-        user = User.query.get(id_user)
-        planet = Planet.query.get(id_planet)
-        if not user or not planet:
-            return jsonify({"error": "The user or planet does not exist. Please enter valid ID values."}), 404
-        
-        favorite_planet = FavoritePlanet.query.filter_by(user_id = id_user, planet_id = id_planet).first()
-        if not favorite_planet:
+        deleted = remove_favorite(FavoritePlanet(user_id = id_user, planet_id = id_planet))
+        if not deleted:
             return jsonify({'error':'Planet not found in their favorites'}), 404
-        
-        db.session.delete(favorite_planet)
-        db.session.commit()
         return jsonify({'message': 'Favorite planet deleted successfully'}), 200
 
+    except GroupCommitBusy as busy:
+        return jsonify(busy.to_dict()), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
@@ -415,23 +716,53 @@ def delete_fav_planet(id_user, id_planet):
 @app.route('/favorite/vehicle/<int:id_user>/<int:id_vehicle>', methods = ['DELETE'])
 def delete_fav_vehicle(id_user, id_vehicle):
     try:
-        user = User.query.get(id_user)
-        vehicle = Vehicle.query.get(id_vehicle)
-        if not user or not vehicle:
-            return jsonify({"error": "The user or vehicle does not exist. Please enter valid ID values."}), 404
-
-        favorite_vehicle = FavoriteVehicle.query.filter_by(user_id = id_user, vehicle_id = id_vehicle).first()
-        if not favorite_vehicle:
+        deleted = remove_favorite(FavoriteVehicle(user_id = id_user, vehicle_id = id_vehicle))
+        if not deleted:
             return jsonify({'error':'Vehicle not found in their favorites'}), 404
-        
-        db.session.delete(favorite_vehicle)
-        db.session.commit()
         return jsonify({'message': 'Favorite vehicle deleted successfully'}), 200
 
+    except GroupCommitBusy as busy:
+        return jsonify(busy.to_dict()), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
+#-----------------------------EXPORTAR--------------------------
+#Descarga una tabla completa en streaming (NDJSON, o un array JSON con ?format=json) sin cargarla en memoria
+@app.route('/export/<string:model_name>', methods=['GET'])
+@read_only
+def export_table(model_name):
+    model = EXPORTABLE_MODELS.get(model_name)
+    if model is None:
+        return jsonify({'error': 'Unknown table. Use one of: ' + ', '.join(EXPORTABLE_MODELS)}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'json'):
+        return jsonify({'error': "format must be 'ndjson' or 'json'"}), 400
+    return export_response(model, fmt)
+
+#-----------------------------IMPORTAR--------------------------
+#Sube un volcado (JSON, NDJSON o CSV) y lo deja en cola para `flask catalog import-worker`; responde 202 con el trabajo
+@app.route('/imports/<string:model_name>', methods=['POST'])
+def create_import(model_name):
+    job = start_upload_import(model_name, request.stream, request.mimetype, request.args.get('format'),
+                              request.content_length)
+    return jsonify({"msg": "ok", "job": job_to_dict(job)}), 202, {'Location': url_for('get_import', job_id=job['id'])}
+
+#Progreso de una importacion
+@app.route('/imports/<string:job_id>', methods=['GET'])
+def get_import(job_id):
+    job = load_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Import not found'}), 404
+    return jsonify({"msg": "ok", "job": job_to_dict(job)}), 200
+
+#Reanuda una importacion interrumpida desde su ultimo checkpoint
+@app.route('/imports/<string:job_id>/resume', methods=['POST'])
+def resume_import_job(job_id):
+    job = resume_import(job_id)
+    return jsonify({"msg": "ok", "job": job_to_dict(job)}), 202
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
+    app.logger.info(startup.warm_up(app))
     app.run(host='0.0.0.0', port=PORT, debug=False)
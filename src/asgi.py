@@ -0,0 +1,326 @@
+"""
+ASGI entry point: the read endpoints served by coroutines over an async SQLAlchemy
+engine, everything else by the Flask app.
+
+    $ uvicorn asgi:application --app-dir src --port 3000
+
+GET /users, /characters, /planets, /vehicles (lists, keyset pages and details) and
+GET /favorites/<user_id> run their queries on an async engine (aiosqlite for
+sqlite:// URLs, asyncpg for postgresql://), so one process keeps many requests in
+flight while they wait on the database. They share the cache, the ETags and the
+response bodies of the Flask views. Any other request (writes, admin, exports,
+metrics, NDJSON) is handed to the Flask app, which runs in a thread pool.
+Responses are compressed under the same rules as the Flask ones (compression.py).
+The lifespan startup warms the sync and async pools and the cache (startup.py).
+With DATABASE_REPLICA_URLS set the async reads use the replicas under the same
+rules as the Flask views (see routing.py).
+
+The sync deployment (gunicorn + src/wsgi.py) is unchanged.
+"""
+import asyncio
+import re
+import time
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import app
+from config import engine_options, configure_engine
+from routing import ReplicaSet, replica_urls, replica_policy, use_primary
+from models import User, Character, Planet, Vehicle
+from favorites import expanded_favorites_statement, favorites_from_rows
+from pagination import parse_page_args, page_statement, page_from_rows
+from lookup import parse_ids, id_keys, ids_from_keys, ids_statement, rows_by_key, ids_response
+from serializers import schema_for, dumps_bytes
+from utils import APIException
+from versions import get_stamp, compute_etag, last_modified_for
+from compression import negotiate, cached_compress, encoded_etag, etag_variants, MIN_SIZE
+import cache
+import metrics
+import ratelimit
+import startup
+
+FAVORITE_TABLES = ('user', 'favorite_character', 'favorite_planet', 'favorite_vehicle', 'character', 'planet', 'vehicle')
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    scheme, separator, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+ASYNC_DATABASE_URL = async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+configure_engine(engine.sync_engine, name='async')
+
+
+def _async_replica(index, url):
+    url = async_database_url(url)
+    replica = create_async_engine(url, **engine_options(url, is_async=True))
+    configure_engine(replica.sync_engine, name='async_replica_%d' % index)
+    return replica
+
+
+replicas = ReplicaSet([_async_replica(index, url) for index, url in enumerate(replica_urls())], replica_policy())
+
+# engine the current request reads from (a replica, or the primary after a recent write)
+read_engine = ContextVar('read_engine', default=engine)
+
+
+class Request:
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.client = scope['client'][0] if scope.get('client') else None
+        self.cookies = {name: morsel.value for name, morsel in SimpleCookie(self.headers.get('cookie', '')).items()}
+
+
+async def fetch(statement):
+    async with read_engine.get().connect() as connection:
+        result = await connection.execute(statement)
+        return result.all()
+
+
+def list_view(model, table, not_found):
+    schema = schema_for(model)
+    cacheable = table in cache.CATALOG_TABLES
+
+    async def load_all():
+        return schema.to_dicts(await fetch(schema.select()))
+
+    async def load_ids(keys):
+        return rows_by_key(model, table, await fetch(ids_statement(model, ids_from_keys(keys))))
+
+    async def view(request):
+        ids_args = parse_ids(model, request.args)
+        if ids_args is not None:
+            keys = id_keys(table, ids_args[0])
+            entries = await (cache.cached_many_async(keys, load_ids) if cacheable else load_ids(keys))
+            return 200, ids_response(table, ids_args, entries)
+        page = parse_page_args(model, request.args)
+        if page is not None:
+            async def load_page():
+                return page_from_rows(await fetch(page_statement(model, page, engine.dialect.name)), page)
+            if cacheable:
+                return 200, await cache.cached_async('%s:page:%s' % (table, page.key()), load_page)
+            return 200, await load_page()
+        results = await (cache.cached_async(table + ':list', load_all) if cacheable else load_all())
+        if results:
+            return 200, {"msg": "ok", "results": results}
+        return 404, {'error': not_found}
+    return view
+
+
+def detail_view(model, table, not_found):
+    schema = schema_for(model)
+    cacheable = table in cache.CATALOG_TABLES
+
+    async def view(request, id):
+        async def load():
+            rows = await fetch(schema.select().where(model.id == id))
+            return dict(zip(schema.fields, rows[0])) if rows else None
+        result = await (cache.cached_async('%s:%d' % (table, id), load) if cacheable else load())
+        if result is None:
+            return 404, {'error': not_found}
+        return 200, {"msg": "ok", "result": result}
+    return view
+
+
+async def favorites_view(request, user_id):
+    expand = request.args.get('expand', '').lower() in ('1', 'true', 'yes')
+    response_body = favorites_from_rows(await fetch(expanded_favorites_statement(user_id)), user_id, expand)
+    if response_body is None:
+        return 404, {"error": "User not found. Please enter a valid user ID to view their favorites."}
+    if not any(response_body.values()):
+        return 404, {'message': 'Favorites not found'}
+    return 200, response_body
+
+
+# (pattern, endpoint name used in the metrics, view, tables for the ETag)
+ROUTES = [
+    (re.compile(r'^/users/?$'), 'get_users', list_view(User, 'user', 'Users not found'), ('user',)),
+    (re.compile(r'^/users/(\d+)/?$'), 'get_user', detail_view(User, 'user', 'User not found'), ('user',)),
+    (re.compile(r'^/characters/?$'), 'get_characters',
+     list_view(Character, 'character', 'Users not found'), ('character',)),
+    (re.compile(r'^/characters/(\d+)/?$'), 'get_character',
+     detail_view(Character, 'character', 'Character not found'), ('character',)),
+    (re.compile(r'^/planets/?$'), 'get_planets', list_view(Planet, 'planet', 'Planets not found'), ('planet',)),
+    (re.compile(r'^/planets/(\d+)/?$'), 'get_planet',
+     detail_view(Planet, 'planet', 'Planet not found'), ('planet',)),
+    (re.compile(r'^/vehicles/?$'), 'get_vehicles', list_view(Vehicle, 'vehicle', 'Vehicles not found'), ('vehicle',)),
+    (re.compile(r'^/vehicles/(\d+)/?$'), 'get_vehicle',
+     detail_view(Vehicle, 'vehicle', 'Vehicle not found'), ('vehicle',)),
+    (re.compile(r'^/favorites/(\d+)/?$'), 'get_fav', favorites_view, FAVORITE_TABLES),
+]
+
+
+def match_route(request):
+    if request.method != 'GET' or 'application/x-ndjson' in request.headers.get('accept', ''):
+        return None
+    for pattern, endpoint, view, tables in ROUTES:
+        match = pattern.match(request.path)
+        if match:
+            return endpoint, view, [int(group) for group in match.groups()], tables
+    return None
+
+
+def _matching_etag(if_none_match, etag):
+    """Returns the tag of `if_none_match` naming a representation of `etag`, or None."""
+    variants = etag_variants(etag)
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag == '*':
+            return etag
+        if tag in variants:
+            return tag
+    return None
+
+
+def _not_modified(request, etag, last_modified):
+    """Returns the ETag to answer a 304 with, or None when the client's copy is stale."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return _matching_etag(if_none_match, etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return etag if last_modified <= parsedate_to_datetime(if_modified_since) else None
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+async def handle(request, view, params, tables):
+    """Runs an async view with the same conditional GET rules as versions.conditional."""
+    stamps = [get_stamp(table) for table in tables]
+    etag = compute_etag(request.path + '?' + request.query_string, request.headers.get('accept', ''), stamps)
+    last_modified = last_modified_for(stamps)
+    validators = [
+        (b'last-modified', last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT').encode()),
+        (b'cache-control', b'no-cache'),
+        (b'vary', b'Accept, Accept-Encoding'),
+    ]
+    matched = _not_modified(request, etag, last_modified)
+    if matched is not None:
+        return 304, None, validators + [(b'etag', ('"%s"' % matched).encode())]
+    read_engine.set(replicas.choose() if replicas and not use_primary(request.cookies) else engine)
+    try:
+        status, body = await view(request, *params)
+    except APIException as error:
+        return error.status_code, error.to_dict(), []
+    except Exception as e:
+        return 500, {'error': 'Internal server error', 'message': str(e)}, []
+    return status, body, validators + [(b'etag', ('"%s"' % etag).encode())] if status == 200 else []
+
+
+def _etag_header(headers):
+    for name, value in headers:
+        if name == b'etag':
+            return value.decode().strip('"')
+    return None
+
+
+async def send_response(send, status, body, headers, accept_encoding=None):
+    headers = list(headers) + [(b'access-control-allow-origin', b'*')]
+    payload = b''
+    if body is not None:
+        payload = dumps_bytes(body, sort_keys=True) + b'\n'
+        headers.append((b'content-type', b'application/json'))
+        encoding = negotiate(accept_encoding) if status == 200 else None
+        if encoding is not None and len(payload) >= MIN_SIZE:
+            etag = _etag_header(headers)
+            payload = cached_compress(payload, encoding, etag)
+            headers = [(name, value) for name, value in headers if name != b'etag']
+            if etag is not None:
+                headers.append((b'etag', ('"%s"' % encoded_etag(etag, encoding)).encode()))
+            headers.append((b'content-encoding', encoding.encode()))
+    headers.append((b'content-length', str(len(payload)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def prime_async_pool(async_engine):
+    connections = []
+    try:
+        for _ in range(startup.warmup_connections(async_engine.sync_engine)):
+            connection = await async_engine.connect()
+            connections.append(connection)
+            await connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            await connection.close()
+    return len(connections)
+
+
+async def warm_up():
+    """The Flask app's warm-up (sync pools and cache) in a thread, then the async pools."""
+    summary = await asyncio.to_thread(startup.warm_up, app)
+    if startup.WARMUP_ENABLED:
+        started = time.perf_counter()
+        connections = 0
+        try:
+            for async_engine in [engine] + list(replicas.engines):
+                connections += await prime_async_pool(async_engine)
+            summary += ', %d async connections' % connections
+        except Exception as e:
+            # like startup.warm_up(): start cold rather than fail the lifespan startup
+            startup.log.warning('Async warm-up failed, starting cold: %s', e, exc_info=True)
+        startup.record('warmup', time.perf_counter() - started)
+    app.logger.info(summary)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await warm_up()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            for replica in replicas.engines:
+                await replica.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+flask_application = WsgiToAsgi(app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    request = Request(scope)
+    route = match_route(request)
+    if route is None:
+        return await flask_application(scope, receive, send)
+    endpoint, view, params, tables = route
+    started = time.perf_counter()
+    slot, retry_after = ratelimit.admit(endpoint, ratelimit.client_key(request.headers, request.client))
+    if retry_after is not None:
+        status = 429
+        await send_response(send, status, ratelimit.too_many_requests_body(), [(b'retry-after', str(retry_after).encode())])
+    else:
+        try:
+            status, body, headers = await handle(request, view, params, tables)
+            await send_response(send, status, body, headers, request.headers.get('accept-encoding'))
+        finally:
+            ratelimit.release(slot)
+    metrics.request_duration.observe(time.perf_counter() - started, endpoint=endpoint, method='GET', status=status)
@@ -0,0 +1,255 @@
+"""
+Bulk creation (and deletion) of catalog entities and favorites.
+
+POST /characters/bulk, /planets/bulk, /vehicles/bulk and /favorites/bulk accept a
+JSON array (or {"items": [...]}) or an NDJSON body (Content-Type:
+application/x-ndjson, one object per line). The whole batch is validated in one
+pass, checked against the database with a handful of IN queries, inserted with a
+single executemany per chunk and committed in one transaction. The response has
+one result per item, in request order.
+
+DELETE /characters/bulk, /planets/bulk and /vehicles/bulk take a list of ids
+({"ids": [...]} or a JSON array). Deletes, like DELETE /users/<id>, are set based:
+one DELETE per favorite table and one for the rows themselves per chunk of ids,
+however many favorites point at them. The favorites' foreign keys also cascade in
+the database, deleting them explicitly keeps the version stamps and caches of
+the favorite tables in step (events.py only sees statements that went through
+the session).
+"""
+import json
+from flask import request
+from sqlalchemy import delete, insert, select, tuple_
+from models import db, User
+from favorites import FAVORITE_KINDS
+from popularity import adjust_favorite_counts, count_deltas, forget_user_favorites
+from utils import APIException
+
+# rows per IN query / executemany, keeps us under the bind parameter limits
+CHUNK_SIZE = 500
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def read_items():
+    """Reads the request body as a list of items (JSON array, {"items": [...]} or NDJSON)."""
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for number, line in enumerate(request.stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise APIException("Line %d is not valid JSON" % number, status_code=400)
+        return items
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('items')
+    if not isinstance(body, list):
+        raise APIException("Expected a JSON array of items, {\"items\": [...]} or an NDJSON body", status_code=400)
+    return body
+
+
+def _insert(model, rows):
+    """Inserts rows with one executemany and returns their new ids in order
+    (None for each row on databases without INSERT .. RETURNING for executemany)."""
+    if not rows:
+        return []
+    dialect = db.session.get_bind().dialect
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+        return list(db.session.scalars(statement, rows))
+    db.session.execute(insert(model), rows)
+    return [None] * len(rows)
+
+
+def _summary(results):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {
+        "msg": "ok",
+        "created": counts.get('created', 0),
+        "duplicates": counts.get('duplicate', 0),
+        "invalid": counts.get('invalid', 0),
+        "results": results,
+    }
+
+
+def _as_text(value):
+    """Catalog fields are strings; numbers are taken as their str(). None for anything else."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def bulk_create(model, items):
+    """Creates every valid item whose name isn't taken. Returns the report."""
+    fields = [name for name in model.public_fields if name != 'id']
+    results = [None] * len(items)
+    pending = {}  # name -> (index, row), first occurrence in the batch wins
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": "invalid", "error": "Item must be an object."}
+            continue
+        missing = [name for name in fields if not item.get(name)]
+        if missing:
+            results[index] = {"index": index, "status": "invalid", "error": "Missing fields: " + ", ".join(missing)}
+            continue
+        row = {name: _as_text(item[name]) for name in fields}
+        wrong_type = [name for name in fields if row[name] is None]
+        if wrong_type:
+            results[index] = {"index": index, "status": "invalid",
+                              "error": "Fields must be strings or numbers: " + ", ".join(wrong_type)}
+            continue
+        if row['name'] in pending:
+            results[index] = {"index": index, "status": "duplicate", "error": "Name repeated in the batch."}
+            continue
+        pending[row['name']] = (index, row)
+
+    names = list(pending)
+    for names_chunk in chunks(names):
+        for name in db.session.scalars(select(model.name).where(model.name.in_(names_chunk))):
+            index, _ = pending.pop(name)
+            results[index] = {"index": index, "status": "duplicate", "error": "Name already exists."}
+
+    to_insert = list(pending.values())
+    for chunk in chunks(to_insert):
+        ids = _insert(model, [row for _, row in chunk])
+        for (index, row), new_id in zip(chunk, ids):
+            results[index] = {"index": index, "status": "created", "id": new_id, "name": row['name']}
+    db.session.commit()
+    return _summary(results)
+
+
+def _parse_id(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _existing_ids(model, ids):
+    found = set()
+    for ids_chunk in chunks(list(ids)):
+        found.update(db.session.scalars(select(model.id).where(model.id.in_(ids_chunk))))
+    return found
+
+
+def bulk_create_favorites(items):
+    """Each item is {"user_id", "character_id"?, "planet_id"?, "vehicle_id"?}; every id
+    given creates its own favorite and gets its own entry in the report."""
+    results = []
+    requested = {kind: {} for kind, _, _, _ in FAVORITE_KINDS}  # kind -> {(user_id, entity_id): result}
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"index": index, "status": "invalid", "error": "Item must be an object."})
+            continue
+        user_id = _parse_id(item.get('user_id'))
+        if user_id is None:
+            results.append({"index": index, "status": "invalid", "error": "A valid user_id is required."})
+            continue
+        kinds = [kind for kind, _, _, _ in FAVORITE_KINDS if item.get(kind + '_id') is not None]
+        if not kinds:
+            results.append({"index": index, "status": "invalid",
+                            "error": "One of character_id, planet_id or vehicle_id is required."})
+            continue
+        for kind in kinds:
+            entity_id = _parse_id(item.get(kind + '_id'))
+            result = {"index": index, "kind": kind, "user_id": user_id, kind + "_id": item.get(kind + '_id')}
+            results.append(result)
+            if entity_id is None:
+                result.update(status="invalid", error="%s_id must be a positive integer." % kind)
+            elif (user_id, entity_id) in requested[kind]:
+                result.update(status="duplicate", error="Favorite repeated in the batch.")
+            else:
+                requested[kind][(user_id, entity_id)] = result
+
+    user_ids = {user_id for pairs in requested.values() for user_id, _ in pairs}
+    existing_users = _existing_ids(User, user_ids)
+
+    for kind, favorite, foreign_key, catalog in FAVORITE_KINDS:
+        pairs = requested[kind]
+        if not pairs:
+            continue
+        existing_entities = _existing_ids(catalog, {entity_id for _, entity_id in pairs})
+        for pair, result in list(pairs.items()):
+            if pair[0] not in existing_users:
+                result.update(status="invalid", error="User not found.")
+                del pairs[pair]
+            elif pair[1] not in existing_entities:
+                result.update(status="invalid", error="The %s does not exist." % kind)
+                del pairs[pair]
+
+        for pairs_chunk in chunks(list(pairs)):
+            taken = select(favorite.user_id, foreign_key).where(tuple_(favorite.user_id, foreign_key).in_(pairs_chunk))
+            for pair in db.session.execute(taken):
+                pairs.pop(tuple(pair)).update(status="duplicate", error="Already in the user's favorites.")
+
+        for pairs_chunk in chunks(list(pairs)):
+            rows = [{"user_id": user_id, foreign_key.key: entity_id} for user_id, entity_id in pairs_chunk]
+            for pair, new_id in zip(pairs_chunk, _insert(favorite, rows)):
+                pairs[pair].update(status="created", id=new_id)
+        adjust_favorite_counts(catalog, count_deltas(entity_id for _, entity_id in pairs))
+    db.session.commit()
+    return _summary(results)
+
+
+def read_ids():
+    """Reads the request body as a list of ids ({"ids": [...]} or a JSON array)."""
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('ids')
+    if not isinstance(body, list):
+        raise APIException("Expected {\"ids\": [...]} or a JSON array of ids", status_code=400)
+    ids = [_parse_id(value) for value in body]
+    if None in ids:
+        raise APIException("Ids must be positive integers", status_code=400)
+    return list(dict.fromkeys(ids))
+
+
+def delete_with_favorites(model, ids):
+    """Deletes the rows of model (User or a catalog model) with these ids and every favorite
+    pointing at them, a fixed number of statements per chunk. Doesn't commit.
+    Returns the ids that existed."""
+    if model is User:
+        dependents = [(favorite, favorite.user_id) for _, favorite, _, _ in FAVORITE_KINDS]
+    else:
+        dependents = [(favorite, foreign_key) for _, favorite, foreign_key, catalog in FAVORITE_KINDS
+                      if catalog is model]
+    deleted = []
+    for ids_chunk in chunks(ids):
+        found = list(db.session.scalars(select(model.id).where(model.id.in_(ids_chunk))))
+        if not found:
+            continue
+        if model is User:
+            forget_user_favorites(found)
+        for favorite, column in dependents:
+            db.session.execute(delete(favorite).where(column.in_(found)),
+                               execution_options={"synchronize_session": False})
+        db.session.execute(delete(model).where(model.id.in_(found)), execution_options={"synchronize_session": False})
+        deleted.extend(found)
+    return deleted
+
+
+def bulk_delete(model, ids):
+    deleted = set(delete_with_favorites(model, ids))
+    db.session.commit()
+    return {
+        "msg": "ok",
+        "deleted": len(deleted),
+        "not_found": [row_id for row_id in ids if row_id not in deleted],
+    }
@@ -0,0 +1,278 @@
+"""
+Read-through cache for the serialized catalog (characters, planets, vehicles).
+
+Keys are namespaced by table name ("character:1", "character:list", ...) and a
+whole namespace is dropped whenever a transaction that wrote to that table is
+committed (see events.py), so the API, the admin views and any other write path
+invalidate the cache without having to remember to. Every namespace also has a
+version that the drop increments: a refill records it before loading and doesn't
+store what it loaded if the version changed meanwhile, so a load that read the
+rows before a write committed can't put them back after the write dropped them.
+
+The default backend is a per-process LRU with a TTL and a size cap. Anything that
+implements CacheBackend (e.g. a Redis or memcached client shared by every gunicorn
+worker) can be plugged in with set_backend(). Values are plain JSON-compatible
+structures so they can be stored by a networked backend as they are. This backend
+only holds catalog data, so its stats describe the catalog alone: the version
+stamps (versions.py) and the compressed bodies (compression.py) have their own
+stores, built with new_backend().
+
+Environment variables:
+    CACHE_ENABLED      set to 0 to disable caching (default 1)
+    CACHE_MAX_ENTRIES  size cap of the local LRU (default 10000)
+    CACHE_TTL          seconds an entry stays valid (default 300)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from events import on_commit
+
+CATALOG_TABLES = ('character', 'planet', 'vehicle')
+
+
+def namespace_of(key):
+    return key.split(':', 1)[0]
+
+
+class CacheBackend:
+    """Interface every cache store has to implement."""
+
+    def get(self, key):
+        """Returns the stored value or None."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Returns {key: value} for the keys that are stored. Networked backends should
+        override it with a single round trip (MGET)."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_namespace(self, namespace):
+        """Drops every key that starts with '<namespace>:' and increments the namespace version."""
+        raise NotImplementedError
+
+    def namespace_version(self, namespace):
+        """A counter delete_namespace() increments. Networked backends keep it in the store
+        (INCR) so a drop by one worker is seen by the others."""
+        raise NotImplementedError
+
+    def set_if_version(self, key, value, version, ttl=None):
+        """set(), unless the namespace of key was dropped since namespace_version() returned
+        version. Networked backends should check and set atomically (a WATCH or a script)."""
+        if self.namespace_version(namespace_of(key)) == version:
+            self.set(key, value, ttl)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocalLRUBackend(CacheBackend):
+    """In-process LRU cache with per-entry expiry, safe to share between threads."""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def set_if_version(self, key, value, version, ttl=None):
+        with self._lock:
+            if self._versions.get(namespace_of(key), 0) == version:
+                self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_namespace(self, namespace):
+        prefix = namespace + ':'
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            self.invalidations += 1
+
+    def namespace_version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "local_lru",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class NullBackend(CacheBackend):
+    """Used when caching is disabled: every lookup is a miss."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def delete_namespace(self, namespace):
+        pass
+
+    def namespace_version(self, namespace):
+        return 0
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": "disabled"}
+
+
+def new_backend(max_entries):
+    """A local store configured from the environment (CACHE_ENABLED, CACHE_TTL)."""
+    if os.getenv('CACHE_ENABLED', '1') == '0':
+        return NullBackend()
+    return LocalLRUBackend(max_entries=max_entries, ttl=float(os.getenv('CACHE_TTL', 300)))
+
+
+_backend = new_backend(int(os.getenv('CACHE_MAX_ENTRIES', 10000)))
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def _namespace_versions(keys):
+    return {namespace: _backend.namespace_version(namespace) for namespace in {namespace_of(key) for key in keys}}
+
+
+def cached(key, loader, ttl=None):
+    """Returns the cached value for key, calling loader() and storing its result on a miss.
+    None results (e.g. an id that doesn't exist) are not cached."""
+    value = _backend.get(key)
+    if value is None:
+        # before loading: a write committed during the load drops the namespace and bumps it
+        version = _backend.namespace_version(namespace_of(key))
+        value = loader()
+        if value is not None:
+            _backend.set_if_version(key, value, version, ttl)
+    return value
+
+
+def cached_many(keys, loader, ttl=None):
+    """cached() for several keys at once: loader(missing_keys) returns {key: value} for the
+    keys it found, which are stored. Returns {key: value} for every key found either way."""
+    values = _backend.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        versions = _namespace_versions(missing)
+        loaded = loader(missing)
+        for key, value in loaded.items():
+            if value is not None:
+                _backend.set_if_version(key, value, versions[namespace_of(key)], ttl)
+        values.update(loaded)
+    return values
+
+
+async def cached_async(key, loader, ttl=None):
+    """Same as cached() for coroutine loaders."""
+    value = _backend.get(key)
+    if value is None:
+        version = _backend.namespace_version(namespace_of(key))
+        value = await loader()
+        if value is not None:
+            _backend.set_if_version(key, value, version, ttl)
+    return value
+
+
+async def cached_many_async(keys, loader, ttl=None):
+    """Same as cached_many() for coroutine loaders."""
+    values = _backend.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        versions = _namespace_versions(missing)
+        loaded = await loader(missing)
+        for key, value in loaded.items():
+            if value is not None:
+                _backend.set_if_version(key, value, versions[namespace_of(key)], ttl)
+        values.update(loaded)
+    return values
+
+
+def invalidate(*tables):
+    for table in tables:
+        _backend.delete_namespace(table)
+
+
+def stats():
+    return _backend.stats()
+
+
+@on_commit
+def _invalidate_written_tables(tables):
+    invalidate(*(table for table in tables if table in CATALOG_TABLES))
@@ -0,0 +1,124 @@
+"""
+Maintenance commands for the catalog, run with the Flask CLI:
+
+    $ flask catalog backfill-numeric [--batch-size 1000]
+    $ flask catalog import <file> --model characters [--format csv] [--batch-size 1000] [--restart]
+    $ flask catalog import-worker [--poll 2] [--once]
+    $ flask catalog reconcile-favorites [--batch-size 1000]
+    $ flask catalog build-related [--top-k 20]
+"""
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, update
+from models import db, Character, Planet, Vehicle
+from measures import parse_measure
+from popularity import reconcile_favorite_counts
+import related
+from imports import (IMPORTABLE_MODELS, IMPORT_BATCH_SIZE, FORMATS, claim_next_job, detect_format, job_id_for_file,
+                     load_job, lock_job, new_job, run_import)
+
+catalog_cli = AppGroup('catalog', help='Catalog maintenance commands.')
+
+CATALOG_MODELS = (Character, Planet, Vehicle)
+
+
+def backfill_numeric(model, batch_size=1000):
+    """Recomputes the numeric copies of the measurements (measures.py), batch_size rows
+    per transaction, walking the table by id. Returns the number of rows visited."""
+    sources = list(model.numeric_fields)
+    columns = [getattr(model, name) for name in sources]
+    last_id, visited = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(model.id, *columns).where(model.id > last_id).order_by(model.id).limit(batch_size)).all()
+        if not rows:
+            return visited
+        values = [dict({"id": row.id}, **{model.numeric_fields[name]: parse_measure(getattr(row, name))
+                                          for name in sources}) for row in rows]
+        db.session.execute(update(model), values)
+        db.session.commit()
+        last_id = rows[-1].id
+        visited += len(rows)
+
+
+@catalog_cli.command('backfill-numeric')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows updated per transaction.')
+def backfill_numeric_command(batch_size):
+    """Fill the *_num columns from the text measurements."""
+    for model in CATALOG_MODELS:
+        click.echo('%s: %d rows' % (model.__tablename__, backfill_numeric(model, batch_size)))
+
+
+@catalog_cli.command('reconcile-favorites')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows checked per transaction.')
+def reconcile_favorites_command(batch_size):
+    """Recompute favorite_count from the favorite tables (run it periodically, e.g. from cron)."""
+    for model in CATALOG_MODELS:
+        click.echo('%s: %d counts fixed' % (model.__tablename__, reconcile_favorite_counts(model, batch_size)))
+
+
+@catalog_cli.command('build-related')
+@click.option('--top-k', default=related.RELATED_TOP_K, show_default=True, help='Recommendations kept per entry.')
+def build_related_command(top_k):
+    """Rebuild the "also favorited" index from the favorite tables (run it periodically, e.g. from cron)."""
+    started = time.perf_counter()
+    entries, neighbors = related.build_index(top_k=top_k)
+    click.echo('%d entries, %d recommendations in %.2fs (%s) -> %s'
+               % (entries, neighbors, time.perf_counter() - started,
+                  'scipy' if related.sparse_available() else 'python', related.RELATED_INDEX_PATH))
+
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--model', 'model_name', required=True, type=click.Choice(list(IMPORTABLE_MODELS)),
+              help='Table the records go to.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Records per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of a previous run and start over.')
+def import_command(path, model_name, fmt, batch_size, restart):
+    """Upsert a SWAPI style JSON/NDJSON/CSV dump by name, resuming an interrupted run."""
+    job_id = job_id_for_file(path, model_name)
+    lock = lock_job(job_id)
+    if lock is None:
+        raise click.ClickException('%s is already being imported by another process' % path)
+    job = None if restart else load_job(job_id)
+    if job is None or job['status'] == 'done':
+        job = new_job(job_id, model_name, path, fmt or detect_format(path))
+    elif job['processed']:
+        click.echo('Resuming after %d records' % job['processed'])
+
+    def progress(job):
+        click.echo('%d records: %d created, %d updated, %d invalid'
+                   % (job['processed'], job['created'], job['updated'], job['invalid']))
+
+    with lock:
+        run_import(job, batch_size, progress)
+    click.echo('Done.')
+
+
+@catalog_cli.command('import-worker')
+@click.option('--poll', default=2.0, show_default=True, help='Seconds between looks for new jobs.')
+@click.option('--once', is_flag=True, help='Exit when no job is waiting instead of polling.')
+def import_worker_command(poll, once):
+    """Run the imports posted to POST /imports/<table>, one at a time, resuming interrupted ones."""
+    while True:
+        claimed = claim_next_job()
+        if claimed is None:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+        job, lock = claimed
+        with lock:
+            click.echo('Import %s (%s): starting after %d records' % (job['id'], job['model'], job['processed']))
+            try:
+                run_import(job)
+            except Exception:
+                # recorded in the job's state file, go on with the next one
+                click.echo('Import %s failed: %s' % (job['id'], job['error']), err=True)
+            else:
+                click.echo('Import %s done: %d created, %d updated, %d invalid'
+                           % (job['id'], job['created'], job['updated'], job['invalid']))
+            finally:
+                db.session.remove()
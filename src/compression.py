@@ -0,0 +1,180 @@
+"""
+Response compression negotiated on Accept-Encoding.
+
+JSON/NDJSON/text responses are compressed with zstd, brotli or gzip, whichever the
+client accepts with the highest q-value (ties go to the order in
+COMPRESS_ENCODINGS). zstd and brotli are optional dependencies (zstandard,
+brotli) and are only offered when installed. Bodies smaller than
+COMPRESS_MIN_SIZE are sent as they are: below ~1 KB the headers and the CPU cost
+outweigh the savings.
+
+Compressed bodies of responses with an ETag (the conditional GETs, see
+versions.py) are kept under "<etag>:<encoding>" in a per-process LRU of their own
+(COMPRESS_CACHE_ENTRIES bodies), not in the catalog cache: they are bytes, and
+they would evict catalog entries and skew its stats. The ETag changes whenever
+the underlying tables do, so a repeated request for an unchanged list page reuses
+the stored bytes instead of compressing again. Every
+encoding gets its own strong ETag ("<etag>-gzip", ...), as HTTP requires for
+different byte representations, and versions.conditional() accepts them back in
+If-None-Match.
+
+Streamed responses (the exports) are compressed chunk by chunk, flushing after
+every chunk so the client keeps receiving rows as they are read.
+
+Environment variables:
+    COMPRESS_ENABLED     set to 0 to turn compression off (default 1)
+    COMPRESS_MIN_SIZE    smallest body in bytes worth compressing (default 1024)
+    COMPRESS_ENCODINGS   preference order (default zstd,br,gzip)
+    COMPRESS_CACHE_ENTRIES  compressed bodies kept per process (default 1000)
+    COMPRESS_LEVEL_GZIP / COMPRESS_LEVEL_BR / COMPRESS_LEVEL_ZSTD   (defaults 6 / 5 / 3)
+"""
+import os
+import zlib
+from flask import request
+from werkzeug.http import parse_accept_header
+import cache
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+ENABLED = os.getenv('COMPRESS_ENABLED', '1') != '0'
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+LEVELS = {
+    'gzip': int(os.getenv('COMPRESS_LEVEL_GZIP', 6)),
+    'br': int(os.getenv('COMPRESS_LEVEL_BR', 5)),
+    'zstd': int(os.getenv('COMPRESS_LEVEL_ZSTD', 3)),
+}
+_bodies = cache.new_backend(int(os.getenv('COMPRESS_CACHE_ENTRIES', 1000)))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+
+_INSTALLED = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+ENCODINGS = [encoding.strip() for encoding in os.getenv('COMPRESS_ENCODINGS', 'zstd,br,gzip').split(',')
+             if _INSTALLED.get(encoding.strip())]
+
+
+def negotiate(accept_encoding):
+    """Returns the encoding to use for this Accept-Encoding header value, or None."""
+    if not ENABLED or not accept_encoding:
+        return None
+    accepted = parse_accept_header(accept_encoding)
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(LEVELS['gzip'], zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'br':
+        return brotli.compress(data, quality=LEVELS['br'])
+    return zstandard.ZstdCompressor(level=LEVELS['zstd']).compress(data)
+
+
+class _StreamCompressor:
+    """compress()/flush()/finish() over the three libraries."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._compressor = zlib.compressobj(LEVELS['gzip'], zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality=LEVELS['br'])
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=LEVELS['zstd']).compressobj()
+
+    def compress_chunk(self, data):
+        """Compresses data and flushes it, so the client can decode it right away."""
+        if self.encoding == 'gzip':
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'gzip':
+            return self._compressor.flush()
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    compressor = _StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield compressor.compress_chunk(chunk)
+        yield compressor.finish()
+    finally:
+        # closes the wrapped generator (and its request context) when the client goes away
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def encoded_etag(etag, encoding):
+    return '%s-%s' % (etag, encoding)
+
+
+def etag_variants(etag):
+    """Every ETag a client may hold for the representation with this (identity) ETag."""
+    return [etag] + [encoded_etag(etag, encoding) for encoding in ('gzip', 'br', 'zstd')]
+
+
+def cached_compress(data, encoding, etag):
+    """compress(), reusing the stored bytes when the same ETag was compressed before."""
+    if etag is None:
+        return compress(data, encoding)
+    key = '%s:%s' % (etag, encoding)
+    body = _bodies.get(key)
+    if body is None:
+        body = compress(data, encoding)
+        _bodies.set(key, body)
+    return body
+
+
+def cache_stats():
+    return _bodies.stats()
+
+
+def _after_request(response):
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code not in (200, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    # 304s keep the ETag versions.conditional() matched
+    if encoding is None or response.status_code != 200 or request.method == 'HEAD':
+        return response
+    etag, weak = response.get_etag()
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        response.set_data(cached_compress(data, encoding, None if weak else etag))
+    response.headers['Content-Encoding'] = encoding
+    if etag is not None and not weak:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+def init_compression(app):
+    if ENABLED:
+        app.after_request(_after_request)
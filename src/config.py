@@ -0,0 +1,203 @@
+"""
+Database engine configuration read from the environment.
+
+engine_options() builds the keyword arguments for create_engine (passed to
+Flask-SQLAlchemy as SQLALCHEMY_ENGINE_OPTIONS) and configure_engine() hooks the
+per-connection setup and the pool instrumentation into an engine once it exists.
+
+Sizing: every gunicorn worker (or uvicorn process) has its own pool, so the
+database sees up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. With
+sync workers a worker only runs one request at a time, so DB_POOL_SIZE=1-2 per
+worker is usually enough; threaded or async workers need roughly one connection
+per request in flight. The db_pool_* gauges and the db_pool_checkout_wait_seconds
+histogram on /metrics show whether requests are queueing for a connection
+(saturation close to 1, growing waits or timeouts) or the pool is oversized
+(peak_checked_out well below size).
+
+Environment variables:
+    DATABASE_URL              database to connect to (default sqlite:////tmp/test.db)
+    DB_POOL_SIZE              connections kept open per process (default 5)
+    DB_MAX_OVERFLOW           extra connections opened under load (default 10)
+    DB_POOL_TIMEOUT           seconds to wait for a free connection before failing (default 30)
+    DB_POOL_RECYCLE           seconds after which a connection is replaced, -1 to never (default 1800)
+    DB_POOL_PRE_PING          set to 0 to skip the liveness check on checkout (default 1)
+    DB_STATEMENT_TIMEOUT_MS   server side statement timeout for PostgreSQL/MySQL, 0 for none (default 0)
+    SQLITE_JOURNAL_MODE       (default WAL)
+    SQLITE_SYNCHRONOUS        (default NORMAL)
+    SQLITE_MMAP_SIZE          bytes of the file memory mapped (default 268435456)
+    SQLITE_CACHE_SIZE         page cache, negative values are KiB (default -64000)
+    SQLITE_BUSY_TIMEOUT_MS    how long a writer waits for the lock (default 5000)
+"""
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from metrics import pool_checkout_wait, register_stats
+
+DEFAULT_DATABASE_URL = "sqlite:////tmp/test.db"
+
+# checkouts that took longer than this are counted as having waited for a connection
+WAIT_THRESHOLD = 0.001
+
+
+def database_url():
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is None:
+        return DEFAULT_DATABASE_URL
+    return db_url.replace("postgres://", "postgresql://")
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _statement_timeout_args(url, timeout_ms):
+    driver = url.get_driver_name()
+    if url.get_backend_name() == 'postgresql':
+        if driver == 'asyncpg':
+            return {'server_settings': {'statement_timeout': str(timeout_ms)}}
+        return {'options': '-c statement_timeout=%d' % timeout_ms}
+    if url.get_backend_name() == 'mysql' and driver == 'mysqldb':
+        return {'init_command': 'SET SESSION max_execution_time=%d' % timeout_ms}
+    return {}
+
+
+def engine_options(url, is_async=False):
+    """Keyword arguments for create_engine/create_async_engine for the given URL."""
+    url = make_url(url)
+    if _is_memory_sqlite(url):
+        # a single shared connection, pool settings don't apply
+        return {}
+    options = {
+        'poolclass': TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') != '0',
+    }
+    timeout_ms = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout_ms:
+        connect_args = _statement_timeout_args(url, timeout_ms)
+        if connect_args:
+            options['connect_args'] = connect_args
+    if url.get_backend_name() == 'sqlite':
+        # SQLite has no server to drop idle connections
+        options['pool_pre_ping'] = False
+    return options
+
+
+def sqlite_pragmas():
+    return [
+        ('foreign_keys', 'ON'),  # SQLite ignores foreign keys unless asked to, and the handlers rely on them
+        ('journal_mode', os.getenv('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('mmap_size', _env_int('SQLITE_MMAP_SIZE', 268435456)),
+        ('cache_size', _env_int('SQLITE_CACHE_SIZE', -64000)),
+        ('busy_timeout', _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    ]
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_pragmas():
+        cursor.execute('PRAGMA %s=%s' % (name, value))
+    cursor.close()
+
+
+class PoolTimer:
+    """Checkout wait times and usage of one pool."""
+
+    def __init__(self, name):
+        self.name = name
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+        self.peak_checked_out = 0
+        self._lock = threading.Lock()
+
+    def record(self, pool, elapsed, timed_out=False):
+        pool_checkout_wait.observe(elapsed, pool=self.name)
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            if elapsed >= WAIT_THRESHOLD:
+                self.waits += 1
+            self.max_wait = max(self.max_wait, elapsed)
+            self.peak_checked_out = max(self.peak_checked_out, pool.checkedout())
+
+
+class _TimedPoolMixin:
+    timer = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            if self.timer is not None:
+                self.timer.record(self, time.perf_counter() - started, timed_out=True)
+            raise
+        if self.timer is not None:
+            self.timer.record(self, time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.timer = self.timer
+        return pool
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "saturation": round(pool.checkedout() / capacity, 3) if capacity > 0 else 0,
+        })
+    timer = getattr(pool, 'timer', None)
+    if timer is not None:
+        with timer._lock:
+            stats.update({
+                "checkouts": timer.checkouts,
+                "waits": timer.waits,
+                "timeouts": timer.timeouts,
+                "max_wait_seconds": round(timer.max_wait, 6),
+                "peak_checked_out": timer.peak_checked_out,
+            })
+    return stats
+
+
+def configure_engine(engine, name='primary'):
+    """Applies the SQLite pragmas on connect and publishes the pool stats as db_pool_<name>_* gauges.
+    Takes a sync Engine (for an AsyncEngine pass engine.sync_engine)."""
+    if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _apply_sqlite_pragmas):
+        event.listen(engine, 'connect', _apply_sqlite_pragmas)
+    if isinstance(engine.pool, _TimedPoolMixin):
+        engine.pool.timer = PoolTimer(name)
+    register_stats('db_pool_' + name, lambda: pool_stats(engine))
+    return engine
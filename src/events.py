@@ -0,0 +1,63 @@
+"""
+Commit hooks keyed by table name.
+
+Listeners registered with on_commit() are called after every successful commit
+with the set of table names written in that transaction, whether the write went
+through the ORM unit of work (db.session.add/delete, the admin views) or through
+insert/update/delete statements passed to db.session.execute().
+"""
+from sqlalchemy import event
+
+_WRITTEN_TABLES = 'written_tables'
+_listeners = []
+
+
+def on_commit(listener):
+    _listeners.append(listener)
+    return listener
+
+
+def _written_tables(session):
+    return session.info.setdefault(_WRITTEN_TABLES, set())
+
+
+def mark_written(session, *tables):
+    """Records writes made on session.connection() directly, which the listeners below
+    don't see, so the on_commit listeners still hear about them."""
+    _written_tables(session).update(tables)
+
+
+def _after_flush(session, flush_context):
+    tables = _written_tables(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__table__', None)
+        if table is not None:
+            tables.add(table.name)
+
+
+def _do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _written_tables(orm_execute_state.session).add(table.name)
+
+
+def _after_commit(session):
+    tables = session.info.pop(_WRITTEN_TABLES, None)
+    if tables:
+        for listener in _listeners:
+            listener(frozenset(tables))
+
+
+def _after_rollback(session):
+    session.info.pop(_WRITTEN_TABLES, None)
+
+
+def track_writes(session):
+    """Attach the write tracking listeners to a (scoped) session, once."""
+    if event.contains(session, 'after_commit', _after_commit):
+        return
+    event.listen(session, 'after_flush', _after_flush)
+    event.listen(session, 'do_orm_execute', _do_orm_execute)
+    event.listen(session, 'after_commit', _after_commit)
+    event.listen(session, 'after_rollback', _after_rollback)
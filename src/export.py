@@ -0,0 +1,58 @@
+"""
+Streaming export of whole tables.
+
+GET /export/<characters|planets|vehicles|users> streams NDJSON (one object per
+line), or a JSON array with ?format=json. The list endpoints stream the same
+NDJSON when the client sends Accept: application/x-ndjson.
+
+Rows are read from a server-side cursor in batches (yield_per) and written out as
+they arrive, so the worker never holds more than one batch in memory no matter
+how big the table is.
+"""
+from flask import Response, request, stream_with_context
+from models import db, User, Character, Planet, Vehicle
+from serializers import schema_for, dumps_bytes
+
+EXPORT_BATCH_SIZE = 1000
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+EXPORTABLE_MODELS = {
+    'characters': Character,
+    'planets': Planet,
+    'vehicles': Vehicle,
+    'users': User,
+}
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def iter_batches(model, batch_size=EXPORT_BATCH_SIZE):
+    """Yields lists of public-field dicts, batch_size rows at a time."""
+    schema = schema_for(model)
+    statement = schema.select().execution_options(yield_per=batch_size)
+    for partition in db.session.execute(statement).partitions():
+        yield schema.to_dicts(partition)
+
+
+def _ndjson_chunks(model):
+    for batch in iter_batches(model):
+        yield b''.join(dumps_bytes(item) + b'\n' for item in batch)
+
+
+def _json_array_chunks(model):
+    yield b'['
+    first = True
+    for batch in iter_batches(model):
+        chunk = b','.join(dumps_bytes(item) for item in batch)
+        yield chunk if first else b',' + chunk
+        first = False
+    yield b']'
+
+
+def export_response(model, fmt='ndjson'):
+    if fmt == 'json':
+        return Response(stream_with_context(_json_array_chunks(model)), mimetype='application/json')
+    return Response(stream_with_context(_ndjson_chunks(model)), mimetype=NDJSON_MIMETYPE)
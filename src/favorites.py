@@ -0,0 +1,108 @@
+"""
+Expanded favorites: a user's favorite characters, planets and vehicles with the
+full catalog payloads, resolved in a single UNION ALL query.
+
+Each arm of the union selects the same column list (kind, favorite id, entity id
+and every catalog field, NULL where the model doesn't have it). A fourth arm
+returns the user row itself so "user not found" and "no favorites" can be told
+apart without a separate query.
+"""
+import sqlalchemy as sa
+from models import db, User, Character, Planet, Vehicle, FavoriteCharacter, FavoritePlanet, FavoriteVehicle
+
+# (kind, favorite model, foreign key column, catalog model)
+FAVORITE_KINDS = (
+    ('character', FavoriteCharacter, FavoriteCharacter.character_id, Character),
+    ('planet', FavoritePlanet, FavoritePlanet.planet_id, Planet),
+    ('vehicle', FavoriteVehicle, FavoriteVehicle.vehicle_id, Vehicle),
+)
+
+# every catalog field except the id, in a stable order
+CATALOG_FIELDS = tuple(dict.fromkeys(
+    name for _, _, _, model in FAVORITE_KINDS for name in model.public_fields if name != 'id'))
+
+
+def _null(type_):
+    return sa.cast(sa.null(), type_)
+
+
+def _favorite_select(kind, favorite, foreign_key, model, user_id):
+    columns = [
+        sa.literal(kind, sa.String(20)).label('kind'),
+        favorite.id.label('favorite_id'),
+        model.id.label('entity_id'),
+    ]
+    for name in CATALOG_FIELDS:
+        if name in model.public_fields:
+            columns.append(getattr(model, name).label(name))
+        else:
+            columns.append(_null(sa.String(120)).label(name))
+    return (sa.select(*columns)
+            .join_from(favorite, model, foreign_key == model.id)
+            .where(favorite.user_id == user_id))
+
+
+def _user_select(user_id):
+    columns = [
+        sa.literal('user', sa.String(20)).label('kind'),
+        _null(sa.Integer).label('favorite_id'),
+        User.id.label('entity_id'),
+    ]
+    columns += [_null(sa.String(120)).label(name) for name in CATALOG_FIELDS]
+    return sa.select(*columns).where(User.id == user_id)
+
+
+def expanded_favorites_statement(user_id):
+    arms = [_user_select(user_id)]
+    arms += [_favorite_select(kind, favorite, fk, model, user_id) for kind, favorite, fk, model in FAVORITE_KINDS]
+    union = sa.union_all(*arms)
+    return union.order_by(union.selected_columns.kind, union.selected_columns.favorite_id)
+
+
+def favorites_from_rows(rows, user_id, expand=True):
+    """Builds the favorites response from the rows of expanded_favorites_statement(),
+    or returns None if the user doesn't exist. With expand=False the catalog payloads
+    are left out, matching the plain GET /favorites/<user_id> response."""
+    models = {kind: model for kind, _, _, model in FAVORITE_KINDS}
+    favorites = {kind: [] for kind in models}
+    user_found = False
+    for row in rows:
+        if row.kind == 'user':
+            user_found = True
+            continue
+        favorite = {
+            "id": row.favorite_id,
+            "user_id": user_id,
+            row.kind + "_id": row.entity_id,
+        }
+        if expand:
+            entity = {'id': row.entity_id}
+            entity.update((name, getattr(row, name)) for name in models[row.kind].public_fields if name != 'id')
+            favorite[row.kind] = entity
+        favorites[row.kind].append(favorite)
+    if not user_found:
+        return None
+    return {
+        "favorites_characters": favorites['character'],
+        "favorites_planets": favorites['planet'],
+        "favorites_vehicles": favorites['vehicle'],
+    }
+
+
+def load_expanded_favorites(user_id):
+    """Returns the expanded favorites of a user, or None if the user doesn't exist."""
+    return favorites_from_rows(db.session.execute(expanded_favorites_statement(user_id)), user_id)
+
+
+def favorite_conflict(favorite):
+    """Explains why inserting `favorite` violated a constraint. Only runs on the
+    error path, the normal insert doesn't look anything up beforehand."""
+    for kind, model, foreign_key, catalog in FAVORITE_KINDS:
+        if isinstance(favorite, model):
+            break
+    entity_id = getattr(favorite, foreign_key.key)
+    if db.session.get(User, favorite.user_id) is None:
+        return {"error": "User not found. Please enter a valid user ID to view their favorites."}, 404
+    if db.session.get(catalog, entity_id) is None:
+        return {"error": "The %s does not exist. Please enter a valid ID." % kind}, 404
+    return {"error": "The %s is already in the user's favorites." % kind}, 409
@@ -0,0 +1,154 @@
+"""
+Filtering, sorting and name search for the catalog list endpoints.
+
+GET /characters?gender=female&eye_color=blue&eye_color=red   equality, a repeated key is an IN
+GET /characters?sort=gender,-name                             sort keys, '-' for descending
+GET /characters?prefix=luk                                    case-insensitive name prefix
+GET /characters?search=darth vader                            every word must appear in the name
+GET /planets?population__gte=1000000&diameter__lt=10000       numeric ranges: __gt, __gte, __lt, __lte
+
+They can be combined with each other and with after/limit/fields (pagination.py)
+and are compiled into the WHERE/ORDER BY of the page query. Arguments that name
+no field and no range are ignored (e.g. a "_=<timestamp>" cache buster), a range
+or a sort on a field that doesn't exist is a 400. Values are compared
+as they are stored. The prefix search is a range on lower(name), which the
+ix_<table>_name_lower index answers; on PostgreSQL it is a LIKE 'prefix%'
+answered by the text_pattern_ops index ix_<table>_name_pattern instead, since
+with a non-C collation a range on the collation order isn't the set of names
+starting with the prefix. On PostgreSQL the word search is a full text query
+backed by a GIN index, elsewhere a LIKE per word. Ranges compare the
+numeric copy of a measurement (measures.py), rows where it isn't a number never
+match.
+"""
+import operator
+import sys
+from sqlalchemy import and_, func, literal_column
+from utils import APIException
+from measures import numeric_fields
+
+# query parameters that are not column filters
+RESERVED_ARGS = ('after', 'limit', 'fields', 'sort', 'prefix', 'search')
+
+SEARCH_CONFIG = literal_column("'simple'")
+
+RANGE_OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+
+def name_search_vector(column):
+    """Expression indexed by the full text search index on PostgreSQL."""
+    return func.to_tsvector(SEARCH_CONFIG, column)
+
+
+def _check_field(model, name):
+    if name not in model.public_fields:
+        raise APIException("Unknown field '%s'" % name, status_code=400,
+                           payload={'allowed_fields': list(model.public_fields)})
+
+
+def _parse_range(model, name, values):
+    field, _, op = name.rpartition('__')
+    if field not in numeric_fields(model):
+        raise APIException("Range filters are only available on: " + ", ".join(numeric_fields(model)),
+                           status_code=400)
+    if len(values) != 1:
+        raise APIException("'%s' can only be given once" % name, status_code=400)
+    try:
+        value = float(values[0])
+    except ValueError:
+        raise APIException("'%s' must be a number" % name, status_code=400)
+    return (field, op, (value,))
+
+
+def is_filter_arg(model, name):
+    """Whether a query argument is a filter: a public field or a range (<field>__<op>)."""
+    return name in model.public_fields or name.rpartition('__')[2] in RANGE_OPERATORS
+
+
+def parse_filters(model, args, reserved=RESERVED_ARGS):
+    """Returns ((field, op, (value, ...)), ...) for every filter argument, sorted by field.
+    op is 'eq' for equality/IN filters or one of RANGE_OPERATORS."""
+    filters = []
+    for name in sorted(set(args.keys())):
+        if name in reserved or not is_filter_arg(model, name):
+            continue
+        values = tuple(sorted(set(args.getlist(name))))
+        if name.rpartition('__')[2] in RANGE_OPERATORS:
+            filters.append(_parse_range(model, name, values))
+            continue
+        filters.append((name, 'eq', values))
+    return tuple(filters)
+
+
+def parse_sort(model, args):
+    """Returns ((field, descending), ...) ending with the primary key, which breaks ties."""
+    raw = args.get('sort')
+    sort = []
+    for name in (raw or '').split(','):
+        name = name.strip()
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if not name:
+            continue
+        _check_field(model, name)
+        if name not in (field for field, _ in sort):
+            sort.append((name, descending))
+    if 'id' not in (field for field, _ in sort):
+        sort.append(('id', False))
+    return tuple(sort)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _prefix_upper_bound(prefix):
+    """The smallest string after every string that starts with prefix, None when there is none."""
+    # U+10FFFF has no next character: the bound comes from the character before it
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        # surrogates can't be stored or sent to the database
+        following = 0xE000
+    return prefix[:-1] + chr(following)
+
+
+def prefix_clause(model, prefix, dialect_name):
+    prefix = prefix.lower()
+    lowered = func.lower(model.name)
+    if dialect_name == 'postgresql':
+        # backslash is already the LIKE escape character on PostgreSQL
+        return lowered.like(_escape_like(prefix) + '%')
+    # a range instead of LIKE so the lower(name) index is used (SQLite and MySQL only use it for ranges)
+    upper_bound = _prefix_upper_bound(prefix)
+    if upper_bound is None:
+        return lowered >= prefix
+    return and_(lowered >= prefix, lowered < upper_bound)
+
+
+def search_clause(model, search, dialect_name):
+    if dialect_name == 'postgresql':
+        return name_search_vector(model.name).op('@@')(func.plainto_tsquery(SEARCH_CONFIG, search))
+    lowered = func.lower(model.name)
+    return and_(*(lowered.like('%' + _escape_like(word) + '%', escape='\\') for word in search.lower().split()))
+
+
+def where_clauses(model, filters, prefix, search, dialect_name):
+    clauses = []
+    for name, op, values in filters:
+        if op in RANGE_OPERATORS:
+            clauses.append(RANGE_OPERATORS[op](getattr(model, numeric_fields(model)[name]), values[0]))
+            continue
+        column = getattr(model, name)
+        clauses.append(column == values[0] if len(values) == 1 else column.in_(values))
+    if prefix:
+        clauses.append(prefix_clause(model, prefix, dialect_name))
+    if search and search.split():
+        clauses.append(search_clause(model, search, dialect_name))
+    return clauses
@@ -0,0 +1,277 @@
+"""
+Group commit for the favorite endpoints.
+
+POST /favorites and DELETE /favorites/<kind>/<user_id>/<id> change one row each,
+so under heavy like/unlike traffic most of their time goes to the COMMIT (the WAL
+fsync, on SQLite and Postgres alike) and, on SQLite, to waiting for the single
+write lock. With FAVORITE_GROUP_COMMIT_SIZE > 0 request threads don't write
+themselves: they queue the change and wait for its result, and one writer thread
+per process applies up to FAVORITE_GROUP_COMMIT_SIZE queued changes in a single
+transaction. The writer takes whatever queued up while the previous batch was
+committing and waits at most FAVORITE_GROUP_COMMIT_WAIT_MS for more, so a quiet
+server adds at most that much latency and a busy one commits once per batch.
+A request waits at most FAVORITE_GROUP_COMMIT_TIMEOUT seconds for its batch and
+then answers 503 (GroupCommitBusy); a change that timed out before the writer
+picked it up is dropped, never written later. The writer logs and survives any
+error in a batch, and is restarted by the next request if its thread is gone.
+
+Each request still gets its own answer. A batch first looks up the users,
+entities and favorites it touches (one query per table), then replays the
+changes in arrival order against that snapshot: adding a favorite that is already
+there (or was added earlier in the batch) is a 409, a missing user or entity a
+404, removing a missing favorite a 404, and only the changes that succeed are
+written. The favorite counts (popularity.py) are adjusted once per kind per batch.
+If the commit still hits a constraint (another process wrote between the lookups
+and the commit), the batch is rolled back and every change is retried in its own
+transaction.
+
+With the default size of 0 every request writes and commits on its own, on the
+request thread.
+
+Environment variables:
+    FAVORITE_GROUP_COMMIT_SIZE      changes per transaction, 0 to commit each request on its own (default 0)
+    FAVORITE_GROUP_COMMIT_WAIT_MS   longest wait for more changes before committing a batch (default 2)
+    FAVORITE_GROUP_COMMIT_TIMEOUT   seconds a request waits for its batch before a 503 (default 10)
+"""
+import os
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future, TimeoutError
+from flask import current_app
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from models import db, User
+from favorites import FAVORITE_KINDS, favorite_conflict
+from popularity import CATALOG_OF, adjust_favorite_counts, count_favorite
+from routing import remember_request_write
+from utils import APIException
+
+# action is 'add' or 'remove', favorite a transient FavoriteCharacter/FavoritePlanet/FavoriteVehicle
+Change = namedtuple('Change', ['action', 'favorite', 'future'])
+
+
+class GroupCommitBusy(APIException):
+
+    def __init__(self):
+        super().__init__('The favorite could not be saved in time, try again shortly.', status_code=503)
+
+
+def _as_id(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _add_now(favorite):
+    #Se inserta directamente: las llaves foraneas y el indice unico (usuario, favorito)
+    #rechazan usuarios o ids inexistentes y favoritos repetidos
+    db.session.add(favorite)
+    #El contador de favoritos del personaje/planeta/vehiculo se actualiza en la misma transaccion
+    count_favorite(favorite, 1)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return favorite_conflict(favorite)
+    return favorite.serialize(), 201
+
+
+def _remove_now(favorite):
+    model = type(favorite)
+    catalog, foreign_key = CATALOG_OF[model]
+    entity_id = getattr(favorite, foreign_key.key)
+    #Un solo DELETE por (usuario, favorito); si no borro ninguna fila el favorito no existe
+    deleted = model.query.filter_by(**{'user_id': favorite.user_id, foreign_key.key: entity_id}).delete()
+    if not deleted:
+        db.session.rollback()
+        return False
+    adjust_favorite_counts(catalog, {entity_id: -1})
+    db.session.commit()
+    return True
+
+
+def _target(change):
+    """(favorite model, user id, entity id) of a change, with ids that aren't integers as None."""
+    model = type(change.favorite)
+    foreign_key = CATALOG_OF[model][1]
+    return model, _as_id(change.favorite.user_id), _as_id(getattr(change.favorite, foreign_key.key))
+
+
+def apply_changes(changes):
+    """Writes a batch of changes in the current transaction, without committing.
+    Returns the result of each: (response body, status) for an add, whether it
+    existed for a remove."""
+    targets = [_target(change) for change in changes]
+    user_ids = {user_id for change, (_, user_id, _) in zip(changes, targets)
+                if change.action == 'add' and user_id is not None}
+    users = set(db.session.scalars(select(User.id).where(User.id.in_(user_ids)))) if user_ids else set()
+    results = [None] * len(changes)
+
+    for kind, model, foreign_key, catalog in FAVORITE_KINDS:
+        positions = [position for position, target in enumerate(targets) if target[0] is model]
+        if not positions:
+            continue
+        pairs = {targets[position][1:] for position in positions if None not in targets[position][1:]}
+        entity_ids = {entity_id for _, entity_id in pairs}
+        entities = set(db.session.scalars(select(catalog.id).where(catalog.id.in_(entity_ids)))) if pairs else set()
+        present = {}
+        if pairs:
+            statement = (select(model.id, model.user_id, foreign_key)
+                         .where(tuple_(model.user_id, foreign_key).in_(list(pairs))))
+            present = {(user_id, entity_id): row_id for row_id, user_id, entity_id in db.session.execute(statement)}
+
+        deltas = Counter()
+        for position in positions:
+            _, user_id, entity_id = targets[position]
+            pair = (user_id, entity_id)
+            if changes[position].action == 'remove':
+                row_id = present.pop(pair, None)
+                if row_id is not None:
+                    db.session.execute(delete(model).where(model.id == row_id))
+                    deltas[entity_id] -= 1
+                results[position] = row_id is not None
+            elif pair in present:
+                results[position] = {"error": "The %s is already in the user's favorites." % kind}, 409
+            elif user_id not in users:
+                results[position] = {"error": "User not found. Please enter a valid user ID to view their favorites."}, 404
+            elif entity_id not in entities:
+                results[position] = {"error": "The %s does not exist. Please enter a valid ID." % kind}, 404
+            else:
+                values = {'user_id': user_id, foreign_key.key: entity_id}
+                row_id = db.session.execute(insert(model).values(**values)).inserted_primary_key[0]
+                present[pair] = row_id
+                deltas[entity_id] += 1
+                results[position] = model(id=row_id, **values).serialize(), 201
+        adjust_favorite_counts(catalog, deltas)
+    return results
+
+
+class GroupCommit:
+    """Queue of favorite changes, committed in batches by one writer thread."""
+
+    def __init__(self, size, wait_ms, timeout=10):
+        self.size = size
+        self.wait = wait_ms / 1000
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.changes = 0
+        self.largest_batch = 0
+        self.retried = 0
+        self.timed_out = 0
+
+    def submit(self, action, favorite):
+        if self.size <= 0:
+            return _add_now(favorite) if action == 'add' else _remove_now(favorite)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(current_app._get_current_object(),),
+                                                name='favorite-group-commit', daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put(Change(action, favorite, future))
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            # if the writer hasn't taken it yet it never will; otherwise it may still commit
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise GroupCommitBusy()
+        # committed on the writer thread, so the request's own commit hook didn't run
+        if result is True or (result is not False and result[1] == 201):
+            remember_request_write()
+        return result
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.wait
+        while len(batch) < self.size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, app):
+        while True:
+            batch = []
+            try:
+                # changes whose request gave up waiting are dropped
+                batch = [change for change in self._next_batch() if change.future.set_running_or_notify_cancel()]
+                if batch:
+                    with app.app_context():
+                        self._commit(batch)
+            except Exception as e:
+                # _commit() answers its own errors; this is anything around it, keep the writer alive
+                app.logger.exception('Favorite group commit failed')
+                for change in batch:
+                    if not change.future.done():
+                        change.future.set_exception(e)
+
+    def _commit(self, batch, retry=True):
+        try:
+            results = apply_changes(batch)
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if not retry:
+                for change in batch:
+                    change.future.set_exception(e)
+                return
+            with self._lock:
+                self.retried += 1
+            # a fresh snapshot per change, each now sees what the other process wrote
+            for change in batch:
+                self._commit([change], retry=False)
+            return
+        except Exception as e:
+            db.session.rollback()
+            for change in batch:
+                change.future.set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.changes += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for change, result in zip(batch, results):
+            change.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "changes": self.changes,
+                "largest_batch": self.largest_batch,
+                "retried": self.retried,
+                "timed_out": self.timed_out,
+            }
+
+
+writer = GroupCommit(int(os.getenv('FAVORITE_GROUP_COMMIT_SIZE', 0)), float(os.getenv('FAVORITE_GROUP_COMMIT_WAIT_MS', 2)),
+                     float(os.getenv('FAVORITE_GROUP_COMMIT_TIMEOUT', 10)))
+
+
+def save_favorite(favorite):
+    """Adds a favorite (a transient FavoriteCharacter, FavoritePlanet or FavoriteVehicle).
+    Returns (response body, status): 201 and the favorite, or the 404/409 of the conflict."""
+    return writer.submit('add', favorite)
+
+
+def remove_favorite(favorite):
+    """Deletes the favorite with the user and entity of `favorite`. Returns whether it existed."""
+    return writer.submit('remove', favorite)
+
+
+def stats():
+    return writer.stats()
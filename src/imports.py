@@ -0,0 +1,431 @@
+"""
+Catalog import from SWAPI style dumps, run off the request path.
+
+    $ flask catalog import people.json --model characters
+    POST /imports/characters   (body: the dump)  ->  202 {"job": {...}}
+    GET  /imports/<job_id>                       ->  progress of the job
+
+A dump is a JSON array, a SWAPI page ({"results": [...]}), a Django fixture
+([{"model": ..., "fields": {...}}]), NDJSON or CSV with a header row. Every format
+is read one record at a time (JSON with an incremental decoder), so a dump of any
+size only ever has one batch in memory. Fields the model doesn't have (url,
+films, created...) are ignored; records missing one of the model's fields are
+counted as invalid and skipped.
+
+Records are read in batches of IMPORT_BATCH_SIZE and upserted by name: names that
+already exist are updated in place (numeric copies included, see measures.py),
+the rest are inserted with one executemany, and every batch is its own
+transaction. After each commit the job's state file (IMPORT_DIR/<job_id>.json)
+records how many records of the dump are done, so an interrupted import resumes
+from the last committed batch instead of starting over. Replaying a batch that
+was committed but not checkpointed is harmless, the upsert makes it idempotent.
+
+Web workers only store the upload (at most IMPORT_MAX_BYTES, larger bodies are a
+413) and queue the job; the import itself runs in a separate process,
+
+    $ flask catalog import-worker
+
+which picks up queued jobs from IMPORT_DIR one at a time (run several for
+parallel imports; they have to share IMPORT_DIR with the web workers). A process
+importing a job holds a lock on it that the OS releases when the process dies,
+so a job left running by a worker that was killed or restarted is picked up and
+resumed by the next import worker without a manual /resume. The state file is
+the source of truth for progress, so any web worker can report on a job. The CLI
+import runs in the foreground; running the same command again resumes it.
+
+Environment variables:
+    IMPORT_DIR          where uploads and job state files are kept (default <tmp>/catalog-imports)
+    IMPORT_MAX_BYTES    largest upload accepted by POST /imports/<table> (default 1 GiB)
+    IMPORT_BATCH_SIZE   records per transaction (default 1000)
+"""
+import csv
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from sqlalchemy import insert, select, update
+from models import db, Character, Planet, Vehicle
+from measures import parse_measure
+from utils import APIException
+
+IMPORT_DIR = os.getenv('IMPORT_DIR', os.path.join(tempfile.gettempdir(), 'catalog-imports'))
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', 1024 ** 3))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+
+IMPORTABLE_MODELS = {
+    'characters': Character,
+    'planets': Planet,
+    'vehicles': Vehicle,
+}
+
+FORMATS = ('json', 'ndjson', 'csv')
+
+FORMAT_MIMETYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonlines': 'ndjson',
+    'text/csv': 'csv',
+}
+
+# characters read at a time from a JSON dump
+READ_CHUNK_SIZE = 64 * 1024
+
+NUMBER_CHARACTERS = '0123456789+-.eE'
+
+# rows per IN query when looking names up
+NAME_CHUNK_SIZE = 500
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson'):
+        return 'ndjson'
+    if extension in FORMATS:
+        return extension
+    raise APIException("Can't tell the format of %s, pass one of: %s" % (path, ', '.join(FORMATS)), status_code=400)
+
+
+def _unwrap(record):
+    # Django fixtures (the SWAPI repo's own dumps) keep the columns under "fields"
+    if isinstance(record, dict) and isinstance(record.get('fields'), dict):
+        return record['fields']
+    return record
+
+
+class _JSONReader:
+    """Decodes the values of a JSON document one at a time from a text file."""
+
+    def __init__(self, dump):
+        self.dump = dump
+        self.buffer = ''
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def _read(self):
+        chunk = self.dump.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """The next non blank character, '' at the end of the file."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer) or not self._read():
+                return self.buffer[self.position:self.position + 1]
+
+    def skip(self, expected):
+        if self.peek() != expected:
+            raise ValueError("Expected '%s' at character %d of the JSON dump" % (expected, self.position))
+        self.position += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # a number cut at the end of the buffer ("1." of "1.5") may go on in the next chunk
+            if (isinstance(value, (int, float)) and not self.buffer[end:].strip(NUMBER_CHARACTERS)
+                    and self._read()):
+                continue
+            self.position = end
+            return value
+
+    def array(self):
+        """Yields the items of the array that starts here."""
+        self.skip('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.position += 1
+                return
+            self.skip(',')
+
+
+def _json_records(dump):
+    reader = _JSONReader(dump)
+    if reader.peek() == '[':
+        yield from reader.array()
+        return
+    if reader.peek() == '{':
+        reader.skip('{')
+        while reader.peek() == '"':
+            key = reader.value()
+            reader.skip(':')
+            if key in ('results', 'items') and reader.peek() == '[':
+                yield from reader.array()
+                return
+            reader.value()
+            if reader.peek() != ',':
+                break
+            reader.skip(',')
+    raise APIException('Expected a JSON array, {"results": [...]} or {"items": [...]}', status_code=400)
+
+
+def iter_records(path, fmt):
+    """Yields the records of the dump as dicts (anything else is passed on to be reported invalid)."""
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8') as dump:
+            yield from csv.DictReader(dump)
+    elif fmt == 'ndjson':
+        with open(path, encoding='utf-8') as dump:
+            for line in dump:
+                if line.strip():
+                    yield _unwrap(json.loads(line))
+    else:
+        with open(path, encoding='utf-8') as dump:
+            for record in _json_records(dump):
+                yield _unwrap(record)
+
+
+def _clean(model, record):
+    """Returns the row to write for a record, or None when it's unusable."""
+    if not isinstance(record, dict):
+        return None
+    row = {}
+    for name in model.public_fields:
+        if name == 'id':
+            continue
+        value = record.get(name)
+        if value is None or value == '':
+            return None
+        row[name] = str(value).strip()
+    return row
+
+
+def upsert_batch(model, rows):
+    """Updates the rows whose name exists and inserts the others, without committing.
+    Returns (created, updated)."""
+    by_name = {row['name']: row for row in rows}  # last occurrence in the batch wins
+    names = list(by_name)
+    existing = {}
+    for start in range(0, len(names), NAME_CHUNK_SIZE):
+        statement = select(model.id, model.name).where(model.name.in_(names[start:start + NAME_CHUNK_SIZE]))
+        for row_id, name in db.session.execute(statement):
+            existing.setdefault(name, []).append(row_id)
+
+    updates, inserts = [], []
+    for name, row in by_name.items():
+        if name in existing:
+            # update by primary key doesn't run the column defaults, so fill the numeric copies here
+            numbers = {column: parse_measure(row[source]) for source, column in model.numeric_fields.items()}
+            updates.extend(dict(row, id=row_id, **numbers) for row_id in existing[name])
+        else:
+            inserts.append(row)
+    if updates:
+        db.session.execute(update(model), updates)
+    if inserts:
+        db.session.execute(insert(model), inserts)
+    return len(inserts), len(by_name) - len(inserts)
+
+
+def _state_path(job_id):
+    return os.path.join(IMPORT_DIR, job_id + '.json')
+
+
+def load_job(job_id):
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_state_path(job_id), encoding='utf-8') as state:
+            return json.load(state)
+    except FileNotFoundError:
+        return None
+
+
+def save_job(job):
+    job['updated_at'] = time.time()
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    temporary = _state_path(job['id']) + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as state:
+        json.dump(job, state)
+    # atomic, readers never see a half written checkpoint
+    os.replace(temporary, _state_path(job['id']))
+
+
+def new_job(job_id, model_name, path, fmt, source='file'):
+    return {
+        "id": job_id,
+        "model": model_name,
+        "source": source,
+        "path": os.path.abspath(path),
+        "format": fmt,
+        "status": "queued",
+        "processed": 0,
+        "created": 0,
+        "updated": 0,
+        "invalid": 0,
+        "error": None,
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+def job_id_for_file(path, model_name):
+    """Stable id for the CLI, so importing the same file again resumes the same job."""
+    return hashlib.sha256(('%s|%s' % (os.path.abspath(path), model_name)).encode()).hexdigest()[:32]
+
+
+def run_import(job, batch_size=None, progress=None):
+    """Imports the job's dump from its checkpoint on. Needs an app context."""
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    model = IMPORTABLE_MODELS[job['model']]
+    job.update(status='running', error=None, started_at=job['started_at'] or time.time())
+    save_job(job)
+    checkpoint = job['processed']
+    try:
+        batch, invalid = [], 0
+        records = iter_records(job['path'], job['format'])
+        for position, record in enumerate(records):
+            if position < checkpoint:
+                continue
+            row = _clean(model, record)
+            if row is None:
+                invalid += 1
+            else:
+                batch.append(row)
+            if len(batch) + invalid >= batch_size:
+                _commit_batch(job, model, batch, invalid, progress)
+                batch, invalid = [], 0
+        if batch or invalid:
+            _commit_batch(job, model, batch, invalid, progress)
+    except Exception as e:
+        db.session.rollback()
+        job.update(status='failed', error=getattr(e, 'message', None) or str(e))
+        save_job(job)
+        raise
+    job.update(status='done', finished_at=time.time())
+    save_job(job)
+    return job
+
+
+def _commit_batch(job, model, rows, invalid, progress):
+    created, updated = upsert_batch(model, rows) if rows else (0, 0)
+    db.session.commit()
+    job['processed'] += len(rows) + invalid
+    job['created'] += created
+    job['updated'] += updated
+    job['invalid'] += invalid
+    save_job(job)
+    if progress is not None:
+        progress(job)
+
+
+def lock_job(job_id):
+    """Locks the job for the process that imports it. The OS drops the lock when that
+    process exits, however it exits. Returns the open lock file, or None when another
+    process holds it."""
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    lock = open(os.path.join(IMPORT_DIR, job_id + '.lock'), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def is_running(job_id):
+    lock = lock_job(job_id)
+    if lock is None:
+        return True
+    lock.close()
+    return False
+
+
+def _waiting(job):
+    # an uploaded job left running without its lock was interrupted (the import worker died)
+    return job is not None and (job['status'] == 'queued'
+                                or (job['status'] == 'running' and job.get('source') == 'upload'))
+
+
+def claim_next_job():
+    """The oldest job waiting for an import worker, locked: (job, lock file), or None."""
+    try:
+        names = os.listdir(IMPORT_DIR)
+    except FileNotFoundError:
+        return None
+    jobs = [load_job(name[:-len('.json')]) for name in names if name.endswith('.json')]
+    for job in sorted(filter(_waiting, jobs), key=lambda job: job['updated_at']):
+        lock = lock_job(job['id'])
+        if lock is None:
+            continue
+        # read again under the lock, another worker may have finished it meanwhile
+        job = load_job(job['id'])
+        if _waiting(job):
+            return job, lock
+        lock.close()
+    return None
+
+
+def save_upload(stream, job_id, fmt, content_length=None):
+    """Copies the request body to IMPORT_DIR in chunks and returns the path.
+    Bodies over IMPORT_MAX_BYTES are a 413."""
+    too_large = APIException('The dump is larger than %d bytes' % IMPORT_MAX_BYTES, status_code=413)
+    if content_length is not None and content_length > IMPORT_MAX_BYTES:
+        raise too_large
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, '%s.upload.%s' % (job_id, fmt))
+    size = 0
+    with open(path, 'wb') as upload:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > IMPORT_MAX_BYTES:
+                # no Content-Length (chunked), or a body longer than it said
+                upload.close()
+                os.remove(path)
+                raise too_large
+            upload.write(chunk)
+    return path
+
+
+def start_upload_import(model_name, stream, mimetype, fmt=None, content_length=None):
+    """Stores the uploaded dump and queues its import for the import worker. Returns the job."""
+    if model_name not in IMPORTABLE_MODELS:
+        raise APIException('Unknown table. Use one of: ' + ', '.join(IMPORTABLE_MODELS), status_code=404)
+    fmt = fmt or FORMAT_MIMETYPES.get(mimetype)
+    if fmt not in FORMATS:
+        raise APIException('Send the dump as JSON, NDJSON or CSV (Content-Type or ?format=)', status_code=415)
+    job_id = uuid.uuid4().hex
+    job = new_job(job_id, model_name, save_upload(stream, job_id, fmt, content_length), fmt, source='upload')
+    save_job(job)
+    return job
+
+
+def resume_import(job_id):
+    """Queues a failed or interrupted job again, to go on from its checkpoint. Returns the job."""
+    job = load_job(job_id)
+    if job is None:
+        raise APIException('Import not found', status_code=404)
+    if job['status'] == 'done':
+        raise APIException('Import already finished', status_code=409)
+    if is_running(job_id):
+        raise APIException('Import still in progress', status_code=409)
+    if job['status'] != 'queued':
+        job['status'] = 'queued'
+        save_job(job)
+    return job
+
+
+def job_to_dict(job):
+    """The job as the API shows it (without server paths)."""
+    return {key: value for key, value in job.items() if key != 'path'}
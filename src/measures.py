@@ -0,0 +1,31 @@
+"""
+Numeric copies of the catalog measurements.
+
+Height, mass, diameter, population... are stored as the strings SWAPI publishes
+("172", "1,358", "unknown", "n/a"). Each of them has a nullable float shadow
+column (<field>_num, listed in the model's numeric_fields) holding the parsed
+number, or NULL when the value isn't a number. The shadow columns are filled on
+every insert and ORM update (see models.py) and by `flask catalog backfill-numeric`
+for rows written by other means, so range filters (?height__gte=150) and the
+/<kind>/stats aggregates run in SQL on an indexed column.
+"""
+import math
+
+
+def parse_measure(value):
+    """Returns the number in a SWAPI style measurement, or None ("unknown", "n/a", "30-165"...)."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        try:
+            number = float(str(value).strip().replace(',', ''))
+        except ValueError:
+            return None
+    return number if math.isfinite(number) else None
+
+
+def numeric_fields(model):
+    """{field: shadow column name} for the model, empty for models without measurements."""
+    return getattr(model, 'numeric_fields', {})
@@ -0,0 +1,215 @@
+"""
+Request latency and SQL instrumentation, exposed in Prometheus text format.
+
+For every request we record, labelled by endpoint:
+    http_request_duration_seconds      wall time of the view (histogram, also by method/status)
+    db_queries_per_request             number of SQL statements executed (histogram)
+    db_query_duration_seconds          time spent in those statements (histogram)
+    response_serialization_seconds     time spent encoding JSON responses (histogram)
+    slow_requests_total                requests slower than SLOW_REQUEST_MS (counter)
+
+and, labelled by pool, db_pool_checkout_wait_seconds (see config.py), and by
+endpoint and reason, rate_limited_total (see ratelimit.py).
+
+Requests slower than SLOW_REQUEST_MS are also logged on the "api.slow" logger
+together with the SQL they ran, which is the quickest way to spot N+1 patterns.
+Other modules can publish their own numbers with register_stats().
+
+Environment variables:
+    METRICS_ENABLED   set to 0 to turn the instrumentation off (default 1)
+    SLOW_REQUEST_MS   slow request threshold in milliseconds (default 500)
+"""
+import logging
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from serializers import FastJSONProvider
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+MAX_CAPTURED_QUERIES = 50
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))
+
+slow_log = logging.getLogger('api.slow')
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}  # labels tuple -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(key, list(values)) for key, values in series]
+        for key, values in series:
+            for bound, count in zip(self.buckets, values):
+                lines.append('%s_bucket%s %d' % (self.name, _labels(key + (('le', _number(bound)),)), count))
+            lines.append('%s_bucket%s %d' % (self.name, _labels(key + (('le', '+Inf'),)), values[-1]))
+            lines.append('%s_sum%s %s' % (self.name, _labels(key), _number(values[-2])))
+            lines.append('%s_count%s %d' % (self.name, _labels(key), values[-1]))
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += ['%s%s %s' % (self.name, _labels(key), _number(value)) for key, value in values]
+        return lines
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs) + '}'
+
+
+request_duration = Histogram('http_request_duration_seconds', 'Request latency by endpoint.', LATENCY_BUCKETS)
+queries_per_request = Histogram('db_queries_per_request', 'SQL statements executed per request.', QUERY_COUNT_BUCKETS)
+query_duration = Histogram('db_query_duration_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS)
+serialization_duration = Histogram('response_serialization_seconds', 'Time spent encoding JSON per request.',
+                                   LATENCY_BUCKETS)
+slow_requests = Counter('slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.')
+pool_checkout_wait = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.',
+                               LATENCY_BUCKETS)
+rate_limited = Counter('rate_limited_total', 'Requests rejected with 429 by the rate limiter.')
+
+METRICS = [request_duration, queries_per_request, query_duration, serialization_duration, slow_requests,
+           pool_checkout_wait, rate_limited]
+
+# name prefix -> callable returning a dict of numbers
+_stats_sources = {}
+
+
+def register_stats(prefix, stats_fn):
+    """Publishes the numeric values of stats_fn() as gauges named <prefix>_<key>."""
+    _stats_sources[prefix] = stats_fn
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for prefix, stats_fn in sorted(_stats_sources.items()):
+        for key, value in sorted(stats_fn().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = '%s_%s' % (prefix, key)
+            lines += ['# TYPE %s gauge' % name, '%s %s' % (name, _number(value))]
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentedJSONProvider(FastJSONProvider):
+    """FastJSONProvider that adds the time spent encoding to the current request."""
+
+    def encode(self, obj):
+        started = time.perf_counter()
+        try:
+            return super().encode(obj)
+        finally:
+            if has_request_context() and 'metrics_started' in g:
+                g.serialization_time += time.perf_counter() - started
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_started'].pop()
+    if not has_request_context() or 'metrics_started' not in g:
+        return
+    elapsed = time.perf_counter() - started
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if len(g.sql_queries) < MAX_CAPTURED_QUERIES:
+        g.sql_queries.append((statement, elapsed))
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('metrics_query_started'):
+        connection.info['metrics_query_started'].pop()
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.sql_queries = []
+    g.serialization_time = 0.0
+
+
+def _after_request(response):
+    if 'metrics_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_started
+    endpoint = request.endpoint or 'unmatched'
+    request_duration.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    queries_per_request.observe(g.sql_count, endpoint=endpoint)
+    query_duration.observe(g.sql_time, endpoint=endpoint)
+    serialization_duration.observe(g.serialization_time, endpoint=endpoint)
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_requests.inc(endpoint=endpoint)
+        slow_log.warning(
+            "slow request %s %s -> %d in %.1f ms (%d queries, %.1f ms SQL, %.1f ms serialization)\n%s",
+            request.method, request.full_path, response.status_code, elapsed * 1000, g.sql_count,
+            g.sql_time * 1000, g.serialization_time * 1000,
+            '\n'.join('  %.2f ms  %s' % (duration * 1000, ' '.join(statement.split()))
+                      for statement, duration in g.sql_queries))
+    return response
+
+
+def init_metrics(app):
+    if os.getenv('METRICS_ENABLED', '1') == '0':
+        return
+    app.json = InstrumentedJSONProvider(app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
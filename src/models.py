@@ -1,16 +1,32 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func
+from routing import RoutingSession
+from filters import name_search_vector
+from measures import parse_measure
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def measure_column(source):
+    """Float copy of a measurement column (see measures.py), computed on insert from the
+    statement's parameters so Core inserts and executemany fill it too."""
+    def default(context):
+        return parse_measure(context.get_current_parameters().get(source))
+    return db.Column(db.Float, nullable=True, index=True, default=default)
 
-db = SQLAlchemy()
 
 class User(db.Model):
+    # columns the API is allowed to expose (never the password)
+    public_fields = ("id", "name", "email")
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), unique=False, nullable=False)
     # is_active = db.Column(db.Boolean(), unique=False, nullable=False)
-    favorite_character = db.relationship('FavoriteCharacter', backref='user', lazy=True)
-    favorite_planet = db.relationship('FavoritePlanet', backref='user', lazy=True)
-    favorite_vehicle = db.relationship('FavoriteVehicle', backref='user', lazy=True)
+    # the database deletes the favorites (ON DELETE CASCADE), deleting a user doesn't load them
+    favorite_character = db.relationship('FavoriteCharacter', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    favorite_planet = db.relationship('FavoritePlanet', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    favorite_vehicle = db.relationship('FavoriteVehicle', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 
     def __repr__(self):
@@ -24,11 +40,13 @@ class User(db.Model):
             # do not serialize the password, its a security breach
         }
 class FavoriteCharacter(db.Model):
+    # a user can favorite a character only once; also serves lookups by user_id
+    __table_args__ = (db.Index('ix_favorite_character_user_id_character_id', 'user_id', 'character_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     #relacion de uno User a muchos con Favorite_character
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_favorite_character_user_id_user', ondelete='CASCADE'), nullable=False)
     #relacion de uno Character a muchos con Favorite_character
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id', name='fk_favorite_character_character_id_character', ondelete='CASCADE'), nullable=False, index=True)
 
     def __repr__(self):
         return '<FavoriteCharacter %r>' % self.id
@@ -42,16 +60,22 @@ class FavoriteCharacter(db.Model):
 
 
 class Character(db.Model):
+    public_fields = ("id", "name", "height", "mass", "hair_color", "skin_color", "eye_color", "birth_year", "gender")
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     height = db.Column(db.String(120), nullable=False)
     mass = db.Column(db.String(120), nullable=False)
-    hair_color = db.Column(db.String(120), nullable=False)
-    skin_color = db.Column(db.String(120), nullable=False)
-    eye_color = db.Column(db.String(120), nullable=False)
+    hair_color = db.Column(db.String(120), nullable=False, index=True)
+    skin_color = db.Column(db.String(120), nullable=False, index=True)
+    eye_color = db.Column(db.String(120), nullable=False, index=True)
     birth_year = db.Column(db.String(120), nullable=False)
-    gender = db.Column(db.String(120), nullable=False)
-    favorite_character = db.relationship('FavoriteCharacter', backref='character', lazy=True)
+    gender = db.Column(db.String(120), nullable=False, index=True)
+    numeric_fields = {"height": "height_num", "mass": "mass_num"}
+    height_num = measure_column('height')
+    mass_num = measure_column('mass')
+    # maintained by the favorite endpoints (see popularity.py), not part of the public fields
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    favorite_character = db.relationship('FavoriteCharacter', backref='character', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return '<Character %r>' % self.name
@@ -70,9 +94,10 @@ class Character(db.Model):
         }
 
 class FavoritePlanet(db.Model):
+    __table_args__ = (db.Index('ix_favorite_planet_user_id_planet_id', 'user_id', 'planet_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_favorite_planet_user_id_user', ondelete='CASCADE'), nullable=False)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id', name='fk_favorite_planet_planet_id_planet', ondelete='CASCADE'), nullable=False, index=True)
 
     def __repr__(self):
         return '<FavoritePlanet %r>' % self.id
@@ -87,15 +112,23 @@ class FavoritePlanet(db.Model):
 
 
 class Planet(db.Model):
+    public_fields = ("id", "name", "rotation_period", "diameter", "climate", "gravity", "terrain", "population")
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     rotation_period = db.Column(db.String(120), nullable=False)
     diameter = db.Column(db.String(120), nullable=False)
-    climate = db.Column(db.String(120), nullable=False)
+    climate = db.Column(db.String(120), nullable=False, index=True)
     gravity = db.Column(db.String(120), nullable=False)
-    terrain = db.Column(db.String(120), nullable=False)
+    terrain = db.Column(db.String(120), nullable=False, index=True)
     population = db.Column(db.String(120), nullable=False)
-    favorite_planet = db.relationship('FavoritePlanet', backref='planet', lazy=True)
+    numeric_fields = {"rotation_period": "rotation_period_num", "diameter": "diameter_num",
+                      "population": "population_num"}
+    rotation_period_num = measure_column('rotation_period')
+    diameter_num = measure_column('diameter')
+    population_num = measure_column('population')
+    # maintained by the favorite endpoints (see popularity.py), not part of the public fields
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    favorite_planet = db.relationship('FavoritePlanet', backref='planet', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return '<Planet %r>' % self.name
@@ -113,9 +146,10 @@ class Planet(db.Model):
         }
     
 class FavoriteVehicle(db.Model):
+    __table_args__ = (db.Index('ix_favorite_vehicle_user_id_vehicle_id', 'user_id', 'vehicle_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_favorite_vehicle_user_id_user', ondelete='CASCADE'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', name='fk_favorite_vehicle_vehicle_id_vehicle', ondelete='CASCADE'), nullable=False, index=True)
 
     def __repr__(self):
         return '<FavoriteVehicle %r>' % self.id
@@ -129,14 +163,20 @@ class FavoriteVehicle(db.Model):
 
 
 class Vehicle(db.Model):
+    public_fields = ("id", "name", "model", "length", "cargo_capacity", "vehicle_class", "manufacturer")
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     model = db.Column(db.String(120), nullable=False)
     length = db.Column(db.String(120), nullable=False)
     cargo_capacity = db.Column(db.String(120), nullable=False)
-    vehicle_class= db.Column(db.String(120), nullable=False)
-    manufacturer= db.Column(db.String(120), nullable=False)
-    favorite_vehicle = db.relationship('FavoriteVehicle', backref='vehicle', lazy=True)
+    vehicle_class= db.Column(db.String(120), nullable=False, index=True)
+    manufacturer= db.Column(db.String(120), nullable=False, index=True)
+    numeric_fields = {"length": "length_num", "cargo_capacity": "cargo_capacity_num"}
+    length_num = measure_column('length')
+    cargo_capacity_num = measure_column('cargo_capacity')
+    # maintained by the favorite endpoints (see popularity.py), not part of the public fields
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    favorite_vehicle = db.relationship('FavoriteVehicle', backref='vehicle', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 
     def __repr__(self):
@@ -154,3 +194,20 @@ class Vehicle(db.Model):
         }
 
 
+# name search (see filters.py): prefix ranges on lower(name), LIKE 'prefix%' and full text on PostgreSQL
+for _model in (Character, Planet, Vehicle):
+    db.Index('ix_%s_name_lower' % _model.__tablename__, func.lower(_model.name))
+    db.Index('ix_%s_name_pattern' % _model.__tablename__, func.lower(_model.name).label('name_lower'),
+             postgresql_ops={'name_lower': 'text_pattern_ops'}).ddl_if(dialect='postgresql')
+    db.Index('ix_%s_name_search' % _model.__tablename__, name_search_vector(_model.name),
+             postgresql_using='gin').ddl_if(dialect='postgresql')
+
+
+def _sync_measure(target, value, oldvalue, initiator):
+    setattr(target, target.numeric_fields[initiator.key], parse_measure(value))
+
+
+# keep the numeric copies in step when a measurement is set through the ORM (API, admin)
+for _model in (Character, Planet, Vehicle):
+    for _field in _model.numeric_fields:
+        event.listen(getattr(_model, _field), 'set', _sync_measure)
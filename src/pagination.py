@@ -0,0 +1,144 @@
+"""
+Keyset (cursor) pagination and column projection for the list endpoints.
+
+GET /characters?after=<cursor>&limit=<n>&fields=name,gender
+
+Pages are walked by the sort key (WHERE (keys) > (cursor) ORDER BY keys LIMIT n,
+by primary key unless ?sort= is given), so every page costs the same no matter
+how deep the client is in the table, and only the requested columns are selected
+instead of loading full ORM objects. Filters, sorting and name search
+(filters.py) are applied in the same query.
+
+next_cursor is the last id when the page is sorted by id, otherwise an opaque
+token that has to be passed back as-is with the same sort.
+"""
+import base64
+import json
+from collections import namedtuple
+from sqlalchemy import and_, or_, select, tuple_
+from models import db
+from utils import APIException
+from filters import RESERVED_ARGS, is_filter_arg, parse_filters, parse_sort, where_clauses
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+DEFAULT_SORT = (('id', False),)
+
+
+class Page(namedtuple('Page', ['after', 'limit', 'fields', 'filters', 'sort', 'prefix', 'search'])):
+
+    def key(self):
+        """Stable string identifying this page, used as a cache key."""
+        return json.dumps(list(self), separators=(',', ':'))
+
+
+def parse_int(args, name, default, minimum):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException("'%s' must be an integer" % name, status_code=400)
+    if value < minimum:
+        raise APIException("'%s' must be greater than or equal to %d" % (name, minimum), status_code=400)
+    return value
+
+
+def parse_fields(model, args):
+    """Returns the projected column names (id always first) or every public field."""
+    raw = args.get('fields')
+    if not raw:
+        return model.public_fields
+    fields = ['id']
+    for name in raw.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in model.public_fields:
+            raise APIException("Unknown field '%s'" % name, status_code=400,
+                               payload={'allowed_fields': list(model.public_fields)})
+        fields.append(name)
+    return tuple(fields)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort):
+    """Returns the sort key values of the last row of the previous page."""
+    if sort == DEFAULT_SORT:
+        return (parse_int({'after': token}, 'after', 0, 0),)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise APIException("'after' is not a cursor returned for this sort", status_code=400)
+    return tuple(values)
+
+
+def parse_page_args(model, args):
+    """Returns a Page when the request has any query argument for pagination, projection,
+    filters, sort or search, otherwise None (other arguments are ignored)."""
+    if not any(name in RESERVED_ARGS or is_filter_arg(model, name) for name in args):
+        return None
+    sort = parse_sort(model, args)
+    after = args.get('after')
+    return Page(
+        decode_cursor(after, sort) if after else None,
+        min(parse_int(args, 'limit', DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE),
+        parse_fields(model, args),
+        parse_filters(model, args),
+        sort,
+        args.get('prefix') or None,
+        args.get('search') or None,
+    )
+
+
+def _after_clause(keys, values):
+    if len({descending for _, descending in keys}) == 1:
+        columns = tuple_(*(column for column, _ in keys))
+        return columns < tuple_(*values) if keys[0][1] else columns > tuple_(*values)
+    # mixed directions: (k1 > v1) OR (k1 = v1 AND k2 < v2) OR ...
+    clauses = []
+    for index, (column, descending) in enumerate(keys):
+        equal = [keys[position][0] == values[position] for position in range(index)]
+        clauses.append(and_(*equal, column < values[index] if descending else column > values[index]))
+    return or_(*clauses)
+
+
+def page_statement(model, page, dialect_name):
+    keys = [(getattr(model, name), descending) for name, descending in page.sort]
+    columns = [getattr(model, name) for name in page.fields]
+    columns += [column for column, _ in keys if column.key not in page.fields]
+    statement = select(*columns).where(*where_clauses(model, page.filters, page.prefix, page.search, dialect_name))
+    if page.after is not None:
+        statement = statement.where(_after_clause(keys, page.after))
+    statement = statement.order_by(*(column.desc() if descending else column for column, descending in keys))
+    # one extra row tells us if there is a next page without a COUNT(*)
+    return statement.limit(page.limit + 1)
+
+
+def _next_cursor(row, page):
+    if page.sort == DEFAULT_SORT:
+        return row.id
+    return encode_cursor([row._mapping[name] for name, _ in page.sort])
+
+
+def page_from_rows(rows, page):
+    rows = list(rows)
+    has_more = len(rows) > page.limit
+    rows = rows[:page.limit]
+    return {
+        "msg": "ok",
+        "results": [{name: row._mapping[name] for name in page.fields} for row in rows],
+        "limit": page.limit,
+        "next_cursor": _next_cursor(rows[-1], page) if has_more else None,
+    }
+
+
+def fetch_page(model, page):
+    return page_from_rows(db.session.execute(page_statement(model, page, db.engine.dialect.name)), page)
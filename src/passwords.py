@@ -0,0 +1,170 @@
+"""
+Password hashing off the request path.
+
+Passwords are stored as scrypt hashes ("scrypt$<log2 n>$<r>$<p>$<salt>$<hash>", 12 byte
+salt and 32 byte key in unpadded base64, about 75 characters so they fit the
+existing user.password column). scrypt is
+deliberately expensive, so hashing and verification run in a small bounded pool
+instead of on every request thread at once: at most PASSWORD_HASH_WORKERS hashes
+run in parallel (hashlib.scrypt releases the GIL, so threads are enough) and at
+most PASSWORD_HASH_QUEUE more wait for a slot. When the queue is full the call
+fails fast with PasswordPoolBusy (503) instead of piling up CPU work behind the
+reads.
+
+Hashes made with other parameters (or passwords stored in plain text before
+hashing existed) still verify; needs_rehash() tells the login path to store a
+fresh hash with the current parameters.
+
+Environment variables:
+    PASSWORD_SCRYPT_N        CPU/memory cost, a power of 2 (default 16384)
+    PASSWORD_SCRYPT_R        block size (default 8)
+    PASSWORD_SCRYPT_P        parallelization (default 1)
+    PASSWORD_HASH_WORKERS    hashes computed in parallel, 0 to hash on the request thread (default 2)
+    PASSWORD_HASH_EXECUTOR   thread or process (default thread)
+    PASSWORD_HASH_QUEUE      hashes allowed to wait for a worker (default 64)
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils import APIException
+
+SCHEME = 'scrypt'
+SALT_BYTES = 12
+KEY_BYTES = 32
+QUEUE_TIMEOUT = 0.1
+
+
+class ScryptParams(namedtuple('ScryptParams', ['n', 'r', 'p'])):
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r * p bytes, leave some headroom
+        return 2 * 128 * self.n * self.r * self.p + 1024 * 1024
+
+
+def current_params():
+    params = ScryptParams(int(os.getenv('PASSWORD_SCRYPT_N', 16384)), int(os.getenv('PASSWORD_SCRYPT_R', 8)),
+                          int(os.getenv('PASSWORD_SCRYPT_P', 1)))
+    if params.n < 2 or params.n & (params.n - 1):
+        raise ValueError('PASSWORD_SCRYPT_N must be a power of 2')
+    return params
+
+
+class PasswordPoolBusy(APIException):
+
+    def __init__(self):
+        super().__init__('Too many password operations in progress, try again shortly.', status_code=503)
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _derive(password, salt, params):
+    return hashlib.scrypt(password.encode(), salt=salt, n=params.n, r=params.r, p=params.p,
+                          maxmem=params.maxmem, dklen=KEY_BYTES)
+
+
+def _parse(stored):
+    """Returns (params, salt, key), or None for a password stored in plain text."""
+    parts = stored.split('$')
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    params = ScryptParams(1 << int(parts[1]), int(parts[2]), int(parts[3]))
+    return params, _b64decode(parts[4]), _b64decode(parts[5])
+
+
+def make_hash(password, params=None):
+    params = params or current_params()
+    salt = os.urandom(SALT_BYTES)
+    return '$'.join([SCHEME, str(params.n.bit_length() - 1), str(params.r), str(params.p),
+                     _b64encode(salt), _b64encode(_derive(password, salt, params))])
+
+
+def check_hash(password, stored):
+    parsed = _parse(stored)
+    if parsed is None:
+        # legacy row from before hashing
+        return hmac.compare_digest(password.encode(), stored.encode())
+    params, salt, key = parsed
+    return hmac.compare_digest(_derive(password, salt, params), key)
+
+
+def needs_rehash(stored):
+    parsed = _parse(stored)
+    return parsed is None or parsed[0] != current_params()
+
+
+class HashPool:
+    """Bounded executor for the KDF calls."""
+
+    def __init__(self, workers, queue_size, kind='thread'):
+        self.workers = workers
+        self._executor = None
+        if workers > 0:
+            executor_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+            self._executor = executor_class(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(timeout=QUEUE_TIMEOUT):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            if self._executor is None:
+                return fn(*args)
+            return self._executor.submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+pool = HashPool(int(os.getenv('PASSWORD_HASH_WORKERS', 2)), int(os.getenv('PASSWORD_HASH_QUEUE', 64)),
+                os.getenv('PASSWORD_HASH_EXECUTOR', 'thread'))
+
+# verified against when the email doesn't exist, so a miss costs as much as a wrong password
+_DUMMY_HASH = None
+
+
+def hash_password(password):
+    return pool.run(make_hash, password, current_params())
+
+
+def verify_password(password, stored):
+    global _DUMMY_HASH
+    if stored is None:
+        if _DUMMY_HASH is None:
+            _DUMMY_HASH = pool.run(make_hash, 'dummy password', current_params())
+        pool.run(check_hash, password, _DUMMY_HASH)
+        return False
+    return pool.run(check_hash, password, stored)
+
+
+def stats():
+    return dict(pool.stats(), scrypt_n=current_params().n)
@@ -0,0 +1,98 @@
+"""
+Favorite counts and the most favorited catalog entries.
+
+GET /characters/popular?limit=10
+
+Every character, planet and vehicle row carries favorite_count, the number of
+favorites pointing at it. The favorite endpoints keep it up to date in the same
+transaction as the favorite itself (UPDATE ... SET favorite_count =
+favorite_count + delta, one executemany per kind), so the leaderboard is an
+index scan on favorite_count that reads `limit` rows instead of a GROUP BY over
+the favorite tables.
+
+The counters are written on session.connection() directly: they aren't public
+fields, so they shouldn't invalidate the catalog caches and ETags the way an ORM
+write to the catalog tables would. The favorite table written in the same
+transaction is what moves the leaderboard's ETag.
+
+Favorites created or deleted outside the API (the admin views, SQL by hand) make
+the counters drift; `flask catalog reconcile-favorites` recomputes them from the
+favorite tables and is meant to run periodically (e.g. from cron).
+"""
+from collections import Counter
+from sqlalchemy import bindparam, func, select, update
+from models import db
+from favorites import FAVORITE_KINDS
+from events import mark_written
+from pagination import parse_int
+from serializers import schema_for
+
+DEFAULT_POPULAR_LIMIT = 10
+MAX_POPULAR_LIMIT = 100
+
+# catalog model -> (favorite model, foreign key column), and favorite model -> (catalog model, foreign key column)
+FAVORITES_OF = {catalog: (favorite, foreign_key) for _, favorite, foreign_key, catalog in FAVORITE_KINDS}
+CATALOG_OF = {favorite: (catalog, foreign_key) for _, favorite, foreign_key, catalog in FAVORITE_KINDS}
+
+
+def adjust_favorite_counts(catalog, deltas):
+    """Adds deltas ({entity id: +n/-n}) to the favorite counts, in the current transaction."""
+    deltas = [{"entity_id": entity_id, "delta": delta} for entity_id, delta in deltas.items() if delta]
+    if not deltas:
+        return
+    table = catalog.__table__
+    statement = (update(table).where(table.c.id == bindparam('entity_id'))
+                 .values(favorite_count=table.c.favorite_count + bindparam('delta')))
+    db.session.connection().execute(statement, deltas)
+
+
+def count_favorite(favorite, delta):
+    """Adds delta to the count of the entity a favorite (FavoriteCharacter, ...) points at."""
+    catalog, foreign_key = CATALOG_OF[type(favorite)]
+    adjust_favorite_counts(catalog, {getattr(favorite, foreign_key.key): delta})
+
+
+def count_deltas(entity_ids, sign=1):
+    return {entity_id: sign * count for entity_id, count in Counter(entity_ids).items()}
+
+
+def forget_user_favorites(user_ids):
+    """Takes the favorites of these users off the counts, before they are deleted."""
+    for catalog, (favorite, foreign_key) in FAVORITES_OF.items():
+        statement = (select(foreign_key, func.count()).where(favorite.user_id.in_(user_ids))
+                     .group_by(foreign_key))
+        adjust_favorite_counts(catalog, {entity_id: -count for entity_id, count in db.session.execute(statement)})
+
+
+def parse_popular_args(args):
+    return min(parse_int(args, 'limit', DEFAULT_POPULAR_LIMIT, 1), MAX_POPULAR_LIMIT)
+
+
+def fetch_popular(catalog, limit):
+    schema = schema_for(catalog)
+    # both keys descending, so the index on favorite_count is read backwards from the top
+    statement = (select(*schema.columns, catalog.favorite_count).where(catalog.favorite_count > 0)
+                 .order_by(catalog.favorite_count.desc(), catalog.id.desc()).limit(limit))
+    fields = schema.fields + ('favorite_count',)
+    return {"msg": "ok", "results": [dict(zip(fields, row)) for row in db.session.execute(statement)]}
+
+
+def reconcile_favorite_counts(catalog, batch_size=1000):
+    """Recomputes favorite_count from the favorite table, batch_size ids per transaction.
+    Returns the number of rows that were wrong."""
+    favorite, foreign_key = FAVORITES_OF[catalog]
+    table = catalog.__table__
+    actual = select(func.count()).where(foreign_key == table.c.id).scalar_subquery()
+    last_id = db.session.scalar(select(func.max(catalog.id))) or 0
+    fixed = 0
+    for start in range(0, last_id, batch_size):
+        # a single statement per batch, so favorites added meanwhile are never lost
+        statement = (update(table).where(table.c.id > start, table.c.id <= start + batch_size,
+                                         table.c.favorite_count != actual)
+                     .values(favorite_count=actual))
+        changed = db.session.connection().execute(statement).rowcount
+        if changed:
+            mark_written(db.session, favorite.__tablename__)
+            fixed += changed
+        db.session.commit()
+    return fixed
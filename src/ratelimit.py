@@ -0,0 +1,223 @@
+"""
+Per client rate limiting and per endpoint concurrency caps.
+
+Every request first takes a token from its client's bucket (RATE_LIMIT_PER_SECOND
+tokens per second, up to RATE_LIMIT_BURST saved up), then a slot from its
+endpoint's concurrency cap when one is configured. Either one running out
+answers 429 with a Retry-After header before the view touches the database.
+Rejections are counted in the rate_limited_total metric (by endpoint and
+reason) and in the rate_limit_* gauges.
+
+The buckets and the in-flight counters live in a RateLimitStore. The default one
+is per process; with several gunicorn workers or hosts plug a shared one (e.g.
+Redis with a Lua script for take()) in with set_store() so the limits are global.
+
+Clients are told apart by their address. Behind a reverse proxy (Render, Heroku,
+nginx) every request comes from the proxy's address, so the limits are off by
+default: turn them on only together with RATE_LIMIT_TRUSTED_PROXIES, the number
+of proxies in front of the app. The client is then the address the outermost
+trusted proxy appended to X-Forwarded-For, counted from the right as werkzeug's
+ProxyFix(x_for=N) does. The hops to its left are whatever the client sent and
+are never used, otherwise a client could get a fresh bucket with every request.
+
+Environment variables:
+    RATE_LIMIT_ENABLED          set to 1 to turn both limits on (default 0)
+    RATE_LIMIT_PER_SECOND       sustained requests per second per client (default 20)
+    RATE_LIMIT_BURST            requests a client can make at once (default 40)
+    RATE_LIMIT_TRUSTED_PROXIES  proxies in front of the app that append to X-Forwarded-For
+                                (default 0: the peer address is the client)
+    CONCURRENCY_LIMITS        endpoint=max in-flight requests, comma separated,
+                              e.g. "get_characters=8,export_table=2" (default none)
+"""
+import math
+import os
+import threading
+import time
+from flask import g, jsonify, request
+from metrics import rate_limited
+
+# never limited: the scraper of /metrics must keep working when clients are rejected
+EXEMPT_ENDPOINTS = ('static', 'get_metrics')
+
+
+class RateLimitStore:
+    """Interface every store of buckets and in-flight counters has to implement."""
+
+    def take(self, key, rate, burst):
+        """Takes a token from the bucket `key`. Returns 0 when allowed, otherwise the
+        seconds until a token is available."""
+        raise NotImplementedError
+
+    def acquire(self, key, limit):
+        """Takes one of `limit` slots for `key`. Returns False when all are in use."""
+        raise NotImplementedError
+
+    def release(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocalStore(RateLimitStore):
+    """In-process store, safe to share between threads."""
+
+    # buckets kept before idle (full) ones are dropped
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now, rate, burst)
+            return wait
+
+    def _prune(self, now, rate, burst):
+        refill = burst / rate
+        for key in [key for key, (_, updated) in self._buckets.items() if now - updated >= refill]:
+            del self._buckets[key]
+
+    def acquire(self, key, limit):
+        with self._lock:
+            in_flight = self._in_flight.get(key, 0)
+            if in_flight >= limit:
+                return False
+            self._in_flight[key] = in_flight + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            in_flight = self._in_flight.get(key, 0) - 1
+            if in_flight > 0:
+                self._in_flight[key] = in_flight
+            else:
+                self._in_flight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "local", "clients": len(self._buckets),
+                    "in_flight": sum(self._in_flight.values())}
+
+
+_store = LocalStore()
+
+
+def set_store(store):
+    global _store
+    _store = store
+
+
+def get_store():
+    return _store
+
+
+def parse_limits(raw):
+    limits = {}
+    for item in (raw or '').split(','):
+        endpoint, _, limit = item.partition('=')
+        if endpoint.strip() and limit.strip():
+            limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', '0') == '1'
+RATE = float(os.getenv('RATE_LIMIT_PER_SECOND', 20))
+BURST = float(os.getenv('RATE_LIMIT_BURST', 40))
+TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))
+CONCURRENCY_LIMITS = parse_limits(os.getenv('CONCURRENCY_LIMITS'))
+
+_rejections = {'rate': 0, 'concurrency': 0}
+_rejections_lock = threading.Lock()
+
+
+def client_key(headers, remote_addr):
+    if TRUSTED_PROXIES:
+        # lower case works for both werkzeug's case-insensitive headers and the ASGI dict
+        hops = [hop.strip() for hop in (headers.get('x-forwarded-for') or '').split(',') if hop.strip()]
+        # each trusted proxy appended one hop; fewer hops than proxies means the header
+        # didn't come through all of them, so like ProxyFix fall back to the peer
+        if len(hops) >= TRUSTED_PROXIES:
+            return hops[-TRUSTED_PROXIES]
+    return remote_addr or 'unknown'
+
+
+def _reject(endpoint, reason, retry_after):
+    rate_limited.inc(endpoint=endpoint, reason=reason)
+    with _rejections_lock:
+        _rejections[reason] += 1
+    return retry_after
+
+
+def admit(endpoint, client):
+    """Returns (slot, retry_after). retry_after is None when the request may go on; slot
+    is the concurrency key to pass to release() afterwards, or None."""
+    if not ENABLED or endpoint in EXEMPT_ENDPOINTS or endpoint.endswith('.static'):
+        return None, None
+    wait = _store.take('client:' + client, RATE, BURST)
+    if wait > 0:
+        return None, _reject(endpoint, 'rate', max(1, math.ceil(wait)))
+    limit = CONCURRENCY_LIMITS.get(endpoint)
+    if not limit:
+        return None, None
+    slot = 'endpoint:' + endpoint
+    if not _store.acquire(slot, limit):
+        return None, _reject(endpoint, 'concurrency', 1)
+    return slot, None
+
+
+def release(slot):
+    if slot is not None:
+        _store.release(slot)
+
+
+def too_many_requests_body():
+    return {'error': 'Too many requests, slow down.'}
+
+
+def _before_request():
+    slot, retry_after = admit(request.endpoint or 'unmatched', client_key(request.headers, request.remote_addr))
+    if retry_after is not None:
+        return jsonify(too_many_requests_body()), 429, {'Retry-After': str(retry_after)}
+    g.rate_limit_slot = slot
+
+
+def _after_request(response):
+    slot = g.pop('rate_limit_slot', None)
+    if slot is not None and response.is_streamed:
+        # exports keep their slot until the last chunk is sent
+        response.call_on_close(lambda: release(slot))
+    else:
+        release(slot)
+    return response
+
+
+def _teardown_request(exception):
+    # only still set when the view raised and after_request didn't run
+    release(g.pop('rate_limit_slot', None))
+
+
+def stats():
+    with _rejections_lock:
+        rejections = dict(_rejections)
+    return dict(_store.stats(), rejected_rate=rejections['rate'], rejected_concurrency=rejections['concurrency'])
+
+
+def init_rate_limit(app):
+    if not ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
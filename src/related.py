@@ -0,0 +1,280 @@
+"""
+"Users who favorited this also favorited": recommendations from co-occurrence.
+
+GET /characters/<id>/related?limit=10   (and /planets/<id>/related, /vehicles/<id>/related)
+
+Two catalog entries (of any kind) co-occur once for every user who has both in
+their favorites. The index keeps, for every entry, its RELATED_TOP_K entries with
+the most co-occurrences, already sorted, so a request is a binary search and a
+slice of at most `limit` items instead of a self-join over the favorite tables.
+
+The index is built by `flask catalog build-related` (run it from cron to refresh
+it), never on the request path: it reads every favorite, which takes longer than
+a request may. Until it has been built the endpoints answer with no results
+("built_at": null). It is written to RELATED_INDEX_PATH as
+flat arrays: the entry keys (sorted), the offsets of each entry's list, and the
+neighbor keys and scores. Workers memory-map that file, so every worker on the
+host shares one copy through the page cache, and pick up a rebuilt file within
+RELATED_RELOAD_SECONDS. The file uses the host's byte order, build it where it
+is served. Its header records which database it was built from (a hash of the
+URL, without the password) and the default path includes that hash, so a file
+left over from another database is neither picked up nor served.
+
+The build is vectorized with NumPy/SciPy when they are installed (the
+co-occurrence matrix is the sparse product A^T A of the user x entry favorites
+matrix) and falls back to counting pairs in Python otherwise. Only the build
+imports them; serving only needs the standard library.
+
+Environment variables:
+    RELATED_INDEX_PATH       where the index is written and read (default <tmp>/related-index-<database hash>.bin)
+    RELATED_TOP_K            recommendations kept per entry (default 20)
+    RELATED_RELOAD_SECONDS   how often workers check for a rebuilt index (default 60)
+"""
+import bisect
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from models import db
+from config import database_url
+from favorites import FAVORITE_KINDS
+from lookup import id_keys, ids_from_keys, ids_statement, rows_by_key
+from pagination import parse_int
+from serializers import serialize_one
+import cache
+
+
+def database_fingerprint():
+    """Identifies the database an index describes (the URL without its password)."""
+    url = make_url(database_url()).render_as_string(hide_password=True)
+    return hashlib.sha256(url.encode()).digest()[:16]
+
+
+RELATED_INDEX_PATH = os.getenv('RELATED_INDEX_PATH') or os.path.join(
+    tempfile.gettempdir(), 'related-index-%s.bin' % database_fingerprint().hex()[:12])
+RELATED_TOP_K = int(os.getenv('RELATED_TOP_K', 20))
+RELATED_RELOAD_SECONDS = float(os.getenv('RELATED_RELOAD_SECONDS', 60))
+
+DEFAULT_RELATED_LIMIT = 10
+
+KINDS = [kind for kind, _, _, _ in FAVORITE_KINDS]
+CATALOG_OF_KIND = {kind: catalog for kind, _, _, catalog in FAVORITE_KINDS}
+
+MAGIC = b'RELIDX02'
+# magic, database fingerprint, entries, neighbors in total, build time (unix seconds)
+HEADER = struct.Struct('=8s16sqqq')
+
+log = logging.getLogger('api.related')
+
+
+def item_key(kind, entity_id):
+    """Packs (kind, id) into one sortable integer."""
+    return KINDS.index(kind) << 32 | entity_id
+
+
+def split_key(key):
+    return KINDS[key >> 32], key & 0xFFFFFFFF
+
+
+def favorite_pairs():
+    """(user ids, item keys) of every favorite, as two parallel arrays."""
+    users, keys = array('q'), array('q')
+    connection = db.session.connection()
+    for kind, favorite, foreign_key, _ in FAVORITE_KINDS:
+        code = KINDS.index(kind) << 32
+        table = favorite.__table__
+        # Core rows, building ORM rows for a million favorites costs more than the whole computation
+        result = connection.execution_options(yield_per=10000).execute(
+            select(table.c.user_id, table.c[foreign_key.key]))
+        for partition in result.partitions():
+            for user_id, entity_id in partition:
+                users.append(user_id)
+                keys.append(code | entity_id)
+    return users, keys
+
+
+def _top_k_python(users, keys, top_k):
+    items_by_user = defaultdict(list)
+    for user_id, key in zip(users, keys):
+        items_by_user[user_id].append(key)
+    counts = defaultdict(Counter)
+    for items in items_by_user.values():
+        for key in items:
+            row = counts[key]
+            for other in items:
+                if other != key:
+                    row[other] += 1
+    entries, offsets, neighbors, scores = array('q', sorted(counts)), array('q', [0]), array('q'), array('i')
+    for key in entries:
+        for other, score in heapq.nsmallest(top_k, counts[key].items(), key=lambda item: (-item[1], item[0])):
+            neighbors.append(other)
+            scores.append(score)
+        offsets.append(len(neighbors))
+    return entries, offsets, neighbors, scores
+
+
+def sparse_available():
+    """Whether NumPy/SciPy are installed. Only the build imports them, workers never load them."""
+    try:
+        import numpy, scipy.sparse  # noqa: F401  optional dependencies
+    except ImportError:
+        return False
+    return True
+
+
+def _top_k_sparse(users, keys, top_k):
+    import numpy
+    from scipy import sparse
+    item_keys, columns = numpy.unique(numpy.frombuffer(keys, dtype=numpy.int64), return_inverse=True)
+    _, rows = numpy.unique(numpy.frombuffer(users, dtype=numpy.int64), return_inverse=True)
+    favorites = sparse.csr_matrix((numpy.ones(len(columns), dtype=numpy.int32), (rows, columns)),
+                                  shape=(rows.max() + 1, len(item_keys)))
+    cooccurrence = (favorites.T @ favorites).tocsr()
+    cooccurrence.setdiag(0)
+    cooccurrence.eliminate_zeros()
+
+    # one sort for every row at once: by row, highest score first, lowest key first among
+    # equal scores (the order of the Python build), then keep the first top_k of each row
+    row_of = numpy.repeat(numpy.arange(len(item_keys)), numpy.diff(cooccurrence.indptr))
+    neighbors = item_keys[cooccurrence.indices]
+    scores = cooccurrence.data
+    order = numpy.lexsort((neighbors, -scores, row_of))
+    rank = numpy.arange(len(order)) - cooccurrence.indptr[row_of]
+    keep = order[rank < top_k]
+    counts = numpy.bincount(row_of[keep], minlength=len(item_keys))
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts[counts > 0])))
+    return (item_keys[counts > 0], offsets.astype(numpy.int64), neighbors[keep].astype(numpy.int64),
+            scores[keep].astype(numpy.int32))
+
+
+def build_index(path=None, top_k=None):
+    """Computes the index from the favorite tables and writes it. Needs an app context.
+    Returns (entries, neighbors)."""
+    path = path or RELATED_INDEX_PATH
+    users, keys = favorite_pairs()
+    if not keys:
+        arrays = array('q'), array('q', [0]), array('q'), array('i')
+    elif sparse_available():
+        arrays = _top_k_sparse(users, keys, top_k or RELATED_TOP_K)
+    else:
+        arrays = _top_k_python(users, keys, top_k or RELATED_TOP_K)
+    entries, neighbors = len(arrays[0]), len(arrays[2])
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.related-')
+    with os.fdopen(descriptor, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, database_fingerprint(), entries, neighbors, int(time.time())))
+        for values in arrays:
+            output.write(values.tobytes())
+    # mkstemp creates it 0600, workers may run as another user
+    os.chmod(temporary, 0o644)
+    # atomic, workers never map a half written file
+    os.replace(temporary, path)
+    return entries, neighbors
+
+
+class RelatedIndex:
+    """Read-only view of an index file, memory-mapped."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self.version = _file_version(os.fstat(source.fileno()))
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, database, entries, total, self.built_at = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError('%s is not a recommendations index' % path)
+        if database != database_fingerprint():
+            raise ValueError('%s was built from another database' % path)
+        view, offset = memoryview(self._map), HEADER.size
+        arrays = []
+        for format, length in (('q', entries), ('q', entries + 1), ('q', total), ('i', total)):
+            size = struct.calcsize(format) * length
+            arrays.append(view[offset:offset + size].cast(format))
+            offset += size
+        self.keys, self.offsets, self.neighbors, self.scores = arrays
+
+    def related(self, key, limit):
+        """[(neighbor key, score)], best first."""
+        row = bisect.bisect_left(self.keys, key)
+        if row == len(self.keys) or self.keys[row] != key:
+            return []
+        start = self.offsets[row]
+        end = min(self.offsets[row + 1], start + limit)
+        return [(self.neighbors[position], self.scores[position]) for position in range(start, end)]
+
+
+def _file_version(status):
+    # a rebuild replaces the file, so the inode changes even within the mtime resolution
+    return status.st_ino, status.st_mtime_ns
+
+
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """The current index, remapped when the file changed, or None when none was built."""
+    global _index, _checked_at
+    if _index is not None and time.monotonic() - _checked_at < RELATED_RELOAD_SECONDS:
+        return _index
+    with _lock:
+        _checked_at = time.monotonic()
+        try:
+            version = _file_version(os.stat(RELATED_INDEX_PATH))
+        except FileNotFoundError:
+            return _index
+        if _index is None or version != _index.version:
+            try:
+                _index = RelatedIndex(RELATED_INDEX_PATH)
+            except ValueError as e:
+                # serve nothing rather than another database's recommendations
+                log.warning('Not using the recommendations index: %s', e)
+                _index = None
+    return _index
+
+
+def parse_related_args(args):
+    return min(parse_int(args, 'limit', DEFAULT_RELATED_LIMIT, 1), RELATED_TOP_K)
+
+
+def _entries(kind, ids):
+    """{cache key: public fields} for the ids of one kind, from the cache or one IN query."""
+    catalog = CATALOG_OF_KIND[kind]
+
+    def load(keys):
+        return rows_by_key(catalog, kind, db.session.execute(ids_statement(catalog, ids_from_keys(keys))))
+    return cache.cached_many(id_keys(kind, ids), load)
+
+
+def fetch_related(kind, entity_id, limit):
+    """The response body, or None when the entity doesn't exist."""
+    catalog = CATALOG_OF_KIND[kind]
+    if cache.cached('%s:%d' % (kind, entity_id), lambda: serialize_one(catalog, entity_id)) is None:
+        return None
+    index = get_index()
+    if index is None:
+        return {"msg": "ok", "results": [], "built_at": None}
+    related = [split_key(key) + (score,) for key, score in index.related(item_key(kind, entity_id), limit)]
+    entries = {}
+    for other_kind in KINDS:
+        ids = [other_id for neighbor_kind, other_id, _ in related if neighbor_kind == other_kind]
+        if ids:
+            entries.update(_entries(other_kind, ids))
+    results = []
+    for neighbor_kind, other_id, score in related:
+        entry = entries.get('%s:%d' % (neighbor_kind, other_id))
+        # deleted since the index was built
+        if entry is not None:
+            results.append(dict(entry, kind=neighbor_kind, score=score))
+    return {"msg": "ok", "results": results, "built_at": index.built_at}
@@ -0,0 +1,159 @@
+"""
+Read replica routing.
+
+When DATABASE_REPLICA_URLS is set, the SELECTs issued by views decorated with
+@read_only run on one of the replicas; everything else (writes, flushes, views
+that aren't marked, the admin, CLI commands) keeps using the primary.
+
+Read-your-writes: a request that commits a write gets a short lived cookie and,
+until it expires, that client's reads go to the primary. For the same amount of
+time after any write every request reads from the primary, so the cache isn't
+refilled from a replica that hasn't caught up yet. "Any write" is the newest
+version stamp (versions.last_write()): with the default per-process stamp store
+that only covers this process's writes, so when the cache is shared between
+workers (cache.set_backend()) the stamps have to be shared too
+(versions.set_backend()), or a worker that didn't write can refill the shared
+cache from a lagging replica.
+
+Environment variables:
+    DATABASE_REPLICA_URLS     comma separated replica URLs (default none: everything on the primary)
+    DATABASE_REPLICA_POLICY   round_robin or least_connections (default round_robin)
+    REPLICA_STICKY_SECONDS    how long reads stay on the primary after a write (default 5)
+"""
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from events import on_commit
+from versions import last_write
+
+STICKY_COOKIE = 'db_primary_until'
+STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+POLICIES = ('round_robin', 'least_connections')
+
+
+def replica_urls():
+    urls = os.getenv('DATABASE_REPLICA_URLS', '')
+    return [url.strip().replace("postgres://", "postgresql://") for url in urls.split(',') if url.strip()]
+
+
+def replica_policy():
+    policy = os.getenv('DATABASE_REPLICA_POLICY', 'round_robin')
+    if policy not in POLICIES:
+        raise ValueError('DATABASE_REPLICA_POLICY must be one of: ' + ', '.join(POLICIES))
+    return policy
+
+
+class ReplicaSet:
+    """Picks one engine (sync or async) out of a list."""
+
+    def __init__(self, engines, policy='round_robin'):
+        self.engines = list(engines)
+        self.policy = policy
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    @staticmethod
+    def _checked_out(engine):
+        return getattr(engine, 'sync_engine', engine).pool.checkedout()
+
+    def choose(self):
+        if self.policy == 'least_connections':
+            return min(self.engines, key=self._checked_out)
+        with self._lock:
+            return self.engines[next(self._counter) % len(self.engines)]
+
+
+_replicas = ReplicaSet([])
+
+
+def init_replicas(app):
+    """Creates an engine per DATABASE_REPLICA_URLS entry with the same options as the primary."""
+    # imported here: config -> metrics -> serializers -> models, and models imports this module
+    from config import engine_options, configure_engine
+    global _replicas
+    engines = []
+    for index, url in enumerate(replica_urls()):
+        engines.append(configure_engine(create_engine(url, **engine_options(url)), name='replica_%d' % index))
+    _replicas = ReplicaSet(engines, replica_policy())
+    if _replicas:
+        app.after_request(_set_sticky_cookie)
+
+
+def replicas():
+    return _replicas
+
+
+def recently_written():
+    stamp = last_write()
+    return stamp is not None and time.time_ns() - stamp < STICKY_SECONDS * 1e9
+
+
+def sticky_until(cookies):
+    """Parses the stickiness cookie, returns 0 when missing or malformed."""
+    try:
+        return float(cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        return 0.0
+
+
+def use_primary(cookies):
+    return recently_written() or sticky_until(cookies) > time.time()
+
+
+def read_only(view):
+    """Marks a view as safe to serve from a replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def replica_for_request():
+    """The replica engine the current request reads from, or None for the primary.
+    Chosen once per request so all its queries see the same snapshot."""
+    if not _replicas or not has_request_context() or not g.get('db_read_only'):
+        return None
+    if 'db_replica' not in g:
+        g.db_replica = None if use_primary(request.cookies) else _replicas.choose()
+    return g.db_replica
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends the SELECTs of read only views to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # plain and compound (UNION) selects; text() statements and writes stay on the primary
+        if bind is None and not self._flushing and getattr(clause, 'is_select', False):
+            replica = replica_for_request()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _set_sticky_cookie(response):
+    if g.get('db_wrote'):
+        response.set_cookie(STICKY_COOKIE, '%.3f' % (time.time() + STICKY_SECONDS),
+                            max_age=int(STICKY_SECONDS) + 1, httponly=True, samesite='Lax')
+    return response
+
+
+def remember_request_write():
+    """Makes the current request send the stickiness cookie for a write committed on
+    another thread on its behalf (groupcommit.py), where _remember_write() can't see it."""
+    if _replicas and has_request_context():
+        g.db_wrote = True
+
+
+@on_commit
+def _remember_write(tables):
+    if tables and _replicas and has_request_context():
+        g.db_wrote = True
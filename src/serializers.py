@@ -0,0 +1,90 @@
+"""
+Schema-driven serialization straight from Core rows, and a faster JSON provider.
+
+The list and detail endpoints used to load ORM objects (identity map, attribute
+instrumentation, one object per row) only to turn each of them into a dict with
+serialize(). Here we select just the model's public columns and zip each row
+tuple with the column names, which produces the same dicts at a fraction of the
+cost.
+
+FastJSONProvider encodes responses with orjson when it is installed and falls
+back to the standard json module otherwise.
+"""
+import json
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+from models import db
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+class Schema:
+    """Public columns of a model and how to turn result rows into dicts."""
+
+    def __init__(self, model, fields=None):
+        self.model = model
+        self.fields = tuple(fields or model.public_fields)
+        self.columns = [getattr(model, name) for name in self.fields]
+
+    def select(self):
+        return select(*self.columns).order_by(self.model.id)
+
+    def to_dicts(self, rows):
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+
+_schemas = {}
+
+
+def schema_for(model):
+    schema = _schemas.get(model)
+    if schema is None:
+        schema = _schemas[model] = Schema(model)
+    return schema
+
+
+def serialize_all(model):
+    schema = schema_for(model)
+    return schema.to_dicts(db.session.execute(schema.select()))
+
+
+def serialize_one(model, id):
+    schema = schema_for(model)
+    row = db.session.execute(schema.select().where(model.id == id)).first()
+    return dict(zip(schema.fields, row)) if row is not None else None
+
+
+def dumps_bytes(obj, sort_keys=False):
+    """Compact JSON bytes, for code that writes JSON outside of a Flask response."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson (sorted keys, same output shape as
+    the default provider). Anything orjson can't encode goes through Flask's default()."""
+
+    def encode(self, obj):
+        """Returns obj encoded as JSON bytes."""
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if self._app.debug:
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=self.default, option=option)
+        return super().dumps(obj).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
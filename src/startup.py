@@ -0,0 +1,151 @@
+"""
+Worker startup: optional admin, warm-up and a report of where the time went.
+
+The admin (seven Flask-Admin ModelViews and their templates) is only set up on
+nodes that serve it. API-only nodes set SERVER_ROLE=api (or ENABLE_ADMIN=0) and
+never import Flask-Admin at all. Flask-Migrate (and alembic) is only imported
+under the `flask` CLI, where the `db` commands need it.
+
+warm_up() runs before a worker takes traffic (gunicorn's post_worker_init hook in
+the root gunicorn.conf.py, the ASGI lifespan startup in asgi.py): it opens
+WARMUP_CONNECTIONS connections on the primary and on every replica at once, so
+the first requests don't each pay for a connect, and loads the catalog lists
+into the cache, so they don't all miss it together, and maps the recommendations
+index (related.py) when one has been built. Importing the app never
+connects to the database, so it is safe to preload in the gunicorn master
+(GUNICORN_PRELOAD=1) and fork.
+
+The warm-up is best effort: when it fails (the database is down or not migrated
+yet) the failure is logged as a warning and the worker starts cold instead of
+failing to boot, which in gunicorn would stop the whole server.
+
+Each phase (imports, app setup, admin, warm-up) is timed; the summary is logged
+once the worker is ready and published as startup_* gauges on /metrics.
+
+Environment variables:
+    SERVER_ROLE              api on API-only nodes, which skips the admin (default all)
+    ENABLE_ADMIN             1/0, overrides what SERVER_ROLE implies
+    WARMUP_ENABLED           set to 0 to skip the warm-up (default 1)
+    WARMUP_CONNECTIONS       connections opened per engine (default: the pool size)
+    WARMUP_CACHE_MAX_ROWS    catalog tables bigger than this aren't loaded into the cache (default 10000)
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SERVER_ROLE = os.getenv('SERVER_ROLE', 'all')
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') != '0'
+WARMUP_CACHE_MAX_ROWS = int(os.getenv('WARMUP_CACHE_MAX_ROWS', 10000))
+
+_started = time.perf_counter()
+_last = _started
+_phases = OrderedDict()
+_lock = threading.Lock()
+
+log = logging.getLogger('api.startup')
+
+
+def admin_enabled():
+    enabled = os.getenv('ENABLE_ADMIN')
+    if enabled is not None:
+        return enabled != '0'
+    return SERVER_ROLE != 'api'
+
+
+def mark(phase):
+    """Ends `phase`: records the seconds since the previous mark (or process start)."""
+    global _last
+    with _lock:
+        now = time.perf_counter()
+        _phases[phase] = _phases.get(phase, 0) + now - _last
+        _last = now
+
+
+def record(phase, seconds):
+    """Adds a phase timed by the caller (the warm-up runs long after the import, in the worker)."""
+    with _lock:
+        _phases[phase] = _phases.get(phase, 0) + seconds
+
+
+def warmup_connections(engine):
+    from sqlalchemy.pool import QueuePool
+    configured = os.getenv('WARMUP_CONNECTIONS')
+    if configured is not None:
+        return int(configured)
+    return engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+
+
+def prime_pool(engine):
+    """Checks out n connections at the same time (so n are opened) and returns them to the pool."""
+    from sqlalchemy import text
+    connections = []
+    try:
+        for _ in range(warmup_connections(engine)):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def prime_cache():
+    """Loads the catalog lists the way GET /characters etc. do. Returns the keys loaded."""
+    # imported here so that importing this module first doesn't pull them into the "imports" phase
+    from sqlalchemy import func, select
+    import cache
+    from models import db, Character, Planet, Vehicle
+    from serializers import serialize_all
+    loaded = []
+    for model in (Character, Planet, Vehicle):
+        table = model.__tablename__
+        if db.session.scalar(select(func.count()).select_from(model)) > WARMUP_CACHE_MAX_ROWS:
+            continue
+        cache.cached(table + ':list', lambda: serialize_all(model))
+        loaded.append(table + ':list')
+    return loaded
+
+
+def warm_up(app):
+    """Primes the pools and the cache. Returns a one line summary of the startup."""
+    from models import db
+    from routing import replicas
+    if not WARMUP_ENABLED:
+        return summary()
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            try:
+                connections = prime_pool(db.engine)
+                for engine in replicas().engines:
+                    connections += prime_pool(engine)
+                keys = prime_cache()
+            finally:
+                db.session.remove()
+        import related
+        index = related.get_index()
+    except Exception as e:
+        log.warning('Warm-up failed, starting cold: %s', e, exc_info=True)
+        return summary('failed (%s)' % type(e).__name__)
+    finally:
+        record('warmup', time.perf_counter() - started)
+    return summary('%d connections, %d cache entries, recommendations index %s'
+                   % (connections, len(keys), 'mapped' if index is not None else 'not built'))
+
+
+def stats():
+    with _lock:
+        phases = dict(_phases)
+    return dict({phase + '_seconds': round(seconds, 4) for phase, seconds in phases.items()},
+                total_seconds=round(sum(phases.values()), 4))
+
+
+def summary(detail=None):
+    with _lock:
+        phases = list(_phases.items())
+    parts = ', '.join('%s %.3fs' % (phase, seconds) for phase, seconds in phases)
+    line = 'startup %.3fs (%s)' % (sum(seconds for _, seconds in phases), parts)
+    return line + ('; warm-up: ' + detail if detail else '')
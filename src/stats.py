@@ -0,0 +1,62 @@
+"""
+Aggregates over a catalog measurement, computed in SQL.
+
+GET /planets/stats?field=population
+GET /characters/stats?field=height&gender=female
+
+Returns count/min/max/avg/sum of the numeric copy of the field (measures.py) over
+the rows matching the same filters and name search as the list endpoint. Rows
+whose value isn't a number ("unknown") are counted in "unknown" and left out of
+the aggregates.
+"""
+import json
+from sqlalchemy import func, select
+from models import db
+from measures import numeric_fields
+from filters import RESERVED_ARGS, parse_filters, where_clauses
+from utils import APIException
+
+STATS_RESERVED_ARGS = RESERVED_ARGS + ('field',)
+
+
+def parse_stats_args(model, args):
+    """Returns (field, filters, prefix, search)."""
+    field = args.get('field')
+    if field not in numeric_fields(model):
+        raise APIException("'field' must be one of: " + ", ".join(numeric_fields(model)), status_code=400)
+    return (field, parse_filters(model, args, reserved=STATS_RESERVED_ARGS),
+            args.get('prefix') or None, args.get('search') or None)
+
+
+def stats_key(stats_args):
+    """Stable string identifying the query, used as a cache key."""
+    return json.dumps(list(stats_args), separators=(',', ':'))
+
+
+def stats_statement(model, stats_args, dialect_name):
+    field, filters, prefix, search = stats_args
+    column = getattr(model, numeric_fields(model)[field])
+    return select(
+        func.count(), func.count(column), func.min(column), func.max(column), func.avg(column), func.sum(column),
+    ).where(*where_clauses(model, filters, prefix, search, dialect_name))
+
+
+def stats_from_row(row, field):
+    count, known, minimum, maximum, average, total = row
+    return {
+        "msg": "ok",
+        "field": field,
+        "result": {
+            "count": count,
+            "unknown": count - known,
+            "min": minimum,
+            "max": maximum,
+            "avg": float(average) if average is not None else None,
+            "sum": total,
+        },
+    }
+
+
+def fetch_stats(model, stats_args):
+    row = db.session.execute(stats_statement(model, stats_args, db.engine.dialect.name)).one()
+    return stats_from_row(row, stats_args[0])
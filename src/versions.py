@@ -0,0 +1,126 @@
+"""
+Per-table version stamps and conditional GET support (ETag / Last-Modified).
+
+Every commit that writes to a table bumps that table's version stamp (a
+nanosecond timestamp, always increasing). A response built from a set of tables
+is fully determined by its URL and their stamps, so the strong ETag is a digest
+of both and can be computed before the view runs: when the client's
+If-None-Match matches, a 304 is returned without querying or serializing
+anything.
+
+Stamps live in their own store, apart from the catalog cache (see cache.py), and
+expire with the cache TTL. A missing stamp is re-created with the current time,
+which can only produce a new ETag, never a stale 304. By default the store is a
+per-process LRU, so a worker that didn't see a write can keep answering 304 for
+at most CACHE_TTL seconds, the same staleness bound as the cache itself; plug a
+shared one in with set_backend() to share the stamps between workers. The newest
+stamp of all is also kept (last_write()), which is how routing.py knows that some
+worker wrote recently.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, make_response, current_app
+import cache
+from events import on_commit
+from compression import etag_variants
+
+_lock = threading.Lock()
+_last_stamp = 0
+
+# one stamp per table
+_backend = cache.new_backend(1000)
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def _new_stamp():
+    global _last_stamp
+    with _lock:
+        _last_stamp = max(time.time_ns(), _last_stamp + 1)
+        return _last_stamp
+
+
+def _key(table):
+    return 'version:' + table
+
+
+LAST_WRITE_KEY = 'version:*'
+
+
+def get_stamp(table):
+    stamp = _backend.get(_key(table))
+    if stamp is None:
+        stamp = bump(table)
+    return stamp
+
+
+def bump(table):
+    stamp = _new_stamp()
+    _backend.set(_key(table), stamp)
+    return stamp
+
+
+@on_commit
+def _bump_written_tables(tables):
+    for table in tables:
+        stamp = bump(table)
+    if tables:
+        _backend.set(LAST_WRITE_KEY, stamp)
+
+
+def last_write():
+    """Stamp of the newest commit that wrote anything, None if none within the TTL."""
+    return _backend.get(LAST_WRITE_KEY)
+
+
+def compute_etag(full_path, accept, stamps):
+    digest = hashlib.sha256(full_path.encode('utf-8'))
+    # the same URL has a different representation per Accept (JSON or NDJSON)
+    digest.update(b"|" + accept.encode('utf-8'))
+    digest.update(','.join(str(stamp) for stamp in stamps).encode('ascii'))
+    return digest.hexdigest()[:32]
+
+
+def last_modified_for(stamps):
+    return datetime.fromtimestamp(max(stamps) // 1_000_000_000, timezone.utc)
+
+
+def conditional(*tables):
+    """Adds ETag/Last-Modified to successful GET responses of a view built from `tables`
+    and answers matching If-None-Match / If-Modified-Since requests with 304."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            stamps = [get_stamp(table) for table in tables]
+            etag = compute_etag(request.full_path, request.headers.get('Accept', ''), stamps)
+            last_modified = last_modified_for(stamps)
+
+            if request.if_none_match:
+                # the client may hold the identity ETag or a compressed one (see compression.py)
+                matched = next((tag for tag in etag_variants(etag) if request.if_none_match.contains_weak(tag)), None)
+                not_modified = matched is not None
+            else:
+                matched = etag
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if not_modified:
+                response = current_app.response_class(status=304)
+                response.set_etag(matched)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            response.vary.add('Accept')
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator